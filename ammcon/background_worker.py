@@ -1,28 +1,76 @@
 #!/usr/bin/env python3
 # Python Standard Library imports
+import atexit
 import datetime as dt
 import logging
 import logging.handlers
 import os.path
+import queue
+import signal
+import sys
+import threading
 # Third party imports
 import click
-import zmq
-from zmq.devices import ThreadDevice
 # Ammcon imports
+from ammcon.broker import Broker
+from ammcon.profiling import StackSampler, ThreadProfiler
 from ammcon.serialmanager import SerialManager, VirtualSerialManager
 from ammcon.templogger import TempLogger
-from ammcon.config import LOG_PATH, SERIAL_PORT
+from ammcon.config import (BROKER_MAX_AGE, BROKER_QUEUE_DEPTH, BROKER_RATE_BURST, BROKER_RATE_LIMIT,
+                           BROKER_REQUEST_TIMEOUT, HUMIDITY_DEADBAND, LOG_PATH, SERIAL_BAUDRATE, SERIAL_BAUDRATES,
+                           SERIAL_PORT, SHADOW_FRESHNESS, TELEMETRY_PORT, TEMP_BULK_COMMAND, TEMP_COMMAND,
+                           TEMP_DEADBAND, TEMP_HEARTBEAT, TEMP_INTERVAL, TEMP_MAX_INTERVAL, TEMP_MIN_INTERVAL,
+                           WOL_BROADCAST, WOL_REPEAT)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler which leaves formatting of the record to the writer thread.
+    Logging arguments must therefore not be modified after being logged.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class LogWriter(threading.Thread):
+    """Background thread which formats and writes queued log records to a handler.
+    Daemon, so that it never holds up exit, but registered to be stopped at exit so that
+    remaining records are still written (also when the main thread dies with an exception).
+    """
+
+    def __init__(self, log_queue, handler):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = log_queue
+        self.handler = handler
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.handler.handle(record)
+
+    def stop(self):
+        """Write remaining records and stop. Can be called more than once."""
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
 
 
 def setup_logging(log_level=logging.DEBUG):
+    """Configure logging so that file I/O and formatting happen on background writer threads.
+    Log calls only put records on a queue, so they don't add latency to serial transactions.
+    Returns list of LogWriter threads. They are stopped at exit, flushing remaining records.
+    """
     # Configure root logger.
     logger = logging.getLogger()
     logger.setLevel(level=log_level)
 
     if not os.path.exists(LOG_PATH):
         os.makedirs(LOG_PATH, exist_ok=True)
-    log_filename = 'ammcon_serial_{0}.log'.format(dt.datetime.now().strftime("%Y%m%d_%Hh%Mm%Ss"))
-    log_fullpath = os.path.join(LOG_PATH, log_filename)
+    timestamp = dt.datetime.now().strftime("%Y%m%d_%Hh%Mm%Ss")
+    log_fullpath = os.path.join(LOG_PATH, 'ammcon_serial_{0}.log'.format(timestamp))
     print('Logging to {}'.format(log_fullpath))
     log_handler = logging.handlers.RotatingFileHandler(log_fullpath,
                                                        maxBytes=5242880,
@@ -32,45 +80,146 @@ def setup_logging(log_level=logging.DEBUG):
         fmt='%(asctime)s %(name)-12s %(levelname)-8s %(message)s (%(filename)s:%(lineno)d)',
         datefmt=None)
     log_handler.setFormatter(log_format)
-    logger.addHandler(log_handler)
-
 
-def setup_zmq(frontend_port, backend_port):
-    device = ThreadDevice(device_type=zmq.QUEUE, in_type=zmq.ROUTER, out_type=zmq.DEALER)
-    # Set high water mark to 1 to set constraint on req/rep pattern
-    device.setsockopt_in(zmq.SNDHWM, 1)
-    device.setsockopt_out(zmq.RCVHWM, 1)
-    device.bind_in("tcp://127.0.0.1:{}".format(frontend_port))
-    device.bind_out("tcp://127.0.0.1:{}".format(backend_port))
+    # Per-command records go to their own file in a compact format: epoch time followed by key=value fields
+    command_fullpath = os.path.join(LOG_PATH, 'ammcon_commands_{0}.log'.format(timestamp))
+    command_handler = logging.handlers.RotatingFileHandler(command_fullpath,
+                                                           maxBytes=5242880,
+                                                           backupCount=3)
+    command_handler.setFormatter(logging.Formatter(fmt='%(created).3f %(message)s'))
+    command_logger = logging.getLogger('ammcon.commands')
+    command_logger.propagate = False
+
+    writers = []
+    for queue_logger, handler in ((logger, log_handler), (command_logger, command_handler)):
+        log_queue = queue.Queue()
+        queue_logger.addHandler(DeferredQueueHandler(log_queue))
+        writer = LogWriter(log_queue, handler)
+        writer.start()
+        # Runs after non-daemon threads have finished, or after an exception in main
+        atexit.register(writer.stop)
+        writers.append(writer)
+    return writers
+
+
+def check_profile_format(ctx, param, value):
+    """Reject pstats output on Python versions that can't run a cProfile profiler per thread."""
+    if value == 'pstats' and sys.version_info >= (3, 12):
+        raise click.BadParameter('pstats needs Python < 3.12 (one cProfile profiler per thread), use collapsed.')
+    return value
+
+
+def setup_zmq(frontend_port, backend_port, queue_depth, rate_limit, rate_burst, max_age, request_timeout):
+    # Broker keeps its own bounded queue and only sends one request at a time to the
+    # serial worker, so no need to rely on ZMQ high water marks for back pressure.
+    device = Broker(frontend_port, backend_port,
+                    queue_depth=queue_depth,
+                    rate_limit=rate_limit,
+                    rate_burst=rate_burst,
+                    max_age=max_age,
+                    request_timeout=request_timeout)
     return device
 
 
 @click.command()
 @click.option('--dev', is_flag=True, help='Enables development mode (simulated serial port)')
-def main(dev):
+@click.option('--queue-depth', default=BROKER_QUEUE_DEPTH, help='Max requests waiting for the serial port.')
+@click.option('--rate-limit', default=BROKER_RATE_LIMIT, help='Max requests/second per client (0 to disable).')
+@click.option('--rate-burst', default=BROKER_RATE_BURST, help='Max burst of requests per client.')
+@click.option('--max-age', default=BROKER_MAX_AGE, help='Seconds a request may wait in the queue (0 to disable).')
+@click.option('--request-timeout', default=BROKER_REQUEST_TIMEOUT,
+              help='Seconds the serial worker has to reply before the client is told it timed out.')
+@click.option('--shadow-freshness', default=SHADOW_FRESHNESS,
+              help='Seconds a device state is trusted for when skipping repeated commands (0 to disable).')
+@click.option('--adaptive', is_flag=True,
+              help='Poll temperature more often while it is changing, and only store readings that change.')
+@click.option('--bulk-readout', is_flag=True,
+              help='Poll all temperature sensors with one bulk readout command (needs hub firmware support).')
+@click.option('--profile', is_flag=True, help='Profile CPU time used by worker threads.')
+@click.option('--profile-format', default='collapsed', type=click.Choice(['collapsed', 'pstats']),
+              callback=check_profile_format,
+              help='Sampled collapsed stacks (for flame graphs), or cProfile pstats per thread (Python < 3.12).')
+@click.option('--profile-duration', default=0,
+              help='Seconds to profile for (0 to profile until SIGUSR1/SIGINT/SIGTERM is received or worker exits).')
+@click.option('--profile-output', default=os.path.join(LOG_PATH, 'profile'), type=click.Path(file_okay=False),
+              help='Directory to write profiling results to.')
+def main(dev, queue_depth, rate_limit, rate_burst, max_age, request_timeout, shadow_freshness, adaptive,
+         bulk_readout, profile, profile_format, profile_duration, profile_output):
     """Setup and start serial port manager thread."""
 
-    setup_logging()
-
-    # Setup and start ZMQ device thread.
+    profiler = None
+    if profile:
+        profile_output = os.path.join(profile_output, dt.datetime.now().strftime("%Y%m%d_%Hh%Mm%Ss"))
+    if profile and profile_format == 'pstats':
+        # Installed before any threads are started, so that all of them are profiled
+        profiler = ThreadProfiler(profile_output)
+        if profile_duration:
+            timer = threading.Timer(profile_duration, profiler.stop)
+            timer.daemon = True
+            timer.start()
+        profiler.install()
+
+    log_writers = setup_logging()
+
+    # Setup and start ZMQ broker thread.
     frontend_port = 5555
     backend_port = 6666
-    device = setup_zmq(frontend_port, backend_port)
+    device = setup_zmq(frontend_port, backend_port, queue_depth, rate_limit, rate_burst, max_age, request_timeout)
     device.start()
 
     logging.info('########### Starting Ammcon serial worker ###########')
-    serial_port = SerialManager(SERIAL_PORT) if not dev else VirtualSerialManager(SERIAL_PORT)
+    manager = SerialManager if not dev else VirtualSerialManager
+    serial_port = manager(SERIAL_PORT,
+                          telemetry_port=TELEMETRY_PORT,
+                          shadow_freshness=shadow_freshness,
+                          baudrate=SERIAL_BAUDRATE,
+                          baudrates=SERIAL_BAUDRATES,
+                          wol_broadcast=WOL_BROADCAST,
+                          wol_repeat=WOL_REPEAT)
     serial_port.start()
 
-    temp_logger = TempLogger(interval=60)
+    temp_logger = TempLogger(interval=TEMP_INTERVAL,
+                             telemetry_port=TELEMETRY_PORT,
+                             adaptive=adaptive,
+                             min_interval=TEMP_MIN_INTERVAL,
+                             max_interval=TEMP_MAX_INTERVAL,
+                             temp_deadband=TEMP_DEADBAND,
+                             humidity_deadband=HUMIDITY_DEADBAND,
+                             heartbeat=TEMP_HEARTBEAT,
+                             command=TEMP_BULK_COMMAND if bulk_readout else TEMP_COMMAND)
     temp_logger.start()
 
+    if profile and profile_format == 'collapsed':
+        threads = [device, serial_port, serial_port.reader, temp_logger] + log_writers
+        profiler = StackSampler(threads, output_dir=profile_output, duration=profile_duration)
+        profiler.start()
+
+    if profiler is not None:
+        def shutdown(signum, frame):
+            """Write profiling results, then stop worker threads so that they can be joined below."""
+            logging.info('Received signal %s, stopping.', signum)
+            profiler.stop()
+            temp_logger.stop()
+            serial_port.stop()
+            device.stop()
+
+        # SIGUSR1 writes results and keeps the worker running
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.stop())
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
     temp_logger.join()
     logging.debug('temp logger ended')
 
     serial_port.join()
     device.join()
 
+    if profiler is not None:
+        profiler.stop()
+
+    for writer in log_writers:
+        writer.stop()
+
 
 if __name__ == '__main__':
     main()
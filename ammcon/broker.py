@@ -0,0 +1,197 @@
+# Python Standard Library imports
+import json
+import logging
+from collections import deque
+from threading import Thread
+from time import monotonic
+# Third party imports
+import zmq
+
+# Replies sent straight back to the client by the broker when a request is not admitted
+BUSY = b'busy'
+RATE_LIMITED = b'rate limited'
+EXPIRED = b'expired'
+# Reply sent when the serial worker did not answer a forwarded request in time
+TIMEOUT = b'timeout'
+# Request answered by the broker itself, never forwarded to the serial worker
+STATS_COMMAND = b'broker stats'
+
+
+class TokenBucket(object):
+    """Simple token bucket used to rate limit a single client."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = monotonic()
+
+    def consume(self, now):
+        """Take one token from the bucket. Return False if the bucket is empty."""
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Broker(Thread):
+    """Request broker sitting between zeroMQ clients (REQ) and the serial worker (REP).
+
+    Replaces the plain zmq.QUEUE device so that admission is explicit: requests wait in a
+    bounded queue, clients are told straight away when the queue is full, when they are
+    sending too fast, or when their request waited longer than max_age, instead of piling
+    up inside ZMQ with no deadline. Only one request is ever in flight to the serial worker,
+    and its client is told if the worker does not answer within request_timeout.
+    """
+
+    def __init__(self, frontend_port, backend_port, queue_depth=16, rate_limit=5.0, rate_burst=10,
+                 max_age=10.0, request_timeout=5.0):
+        Thread.__init__(self)
+        self.daemon = False
+        self.stop_thread = 0  # Flag used to gracefully exit thread
+
+        self.queue_depth = queue_depth
+        self.rate_limit = rate_limit  # requests/second per client, 0 to disable
+        self.rate_burst = rate_burst
+        self.max_age = max_age  # seconds, 0 to disable
+        self.request_timeout = request_timeout  # seconds
+
+        # Pending requests: (enqueue time, routing envelope, message frames)
+        self.queue = deque()
+        self.buckets = {}
+        # Routing envelope of request being handled by the serial worker, and when it was forwarded
+        self.in_flight = None
+        self.in_flight_since = 0
+        self.stats = {'queue_depth': 0,
+                      'in_flight': False,
+                      'forwarded': 0,
+                      'rejected_busy': 0,
+                      'rejected_rate': 0,
+                      'expired': 0,
+                      'timed_out': 0}
+
+        context = zmq.Context().instance()
+        self.frontend = context.socket(zmq.ROUTER)
+        self.frontend.bind("tcp://127.0.0.1:{}".format(frontend_port))
+        self.backend = context.socket(zmq.DEALER)
+        self.backend.bind("tcp://127.0.0.1:{}".format(backend_port))
+
+    def run(self):
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        poller.register(self.backend, zmq.POLLIN)
+
+        while self.stop_thread != 1:
+            # Poll with a timeout so that stale requests are expired even when idle
+            events = dict(poller.poll(100))
+            now = monotonic()
+
+            if self.backend in events:
+                self.handle_response(self.backend.recv_multipart())
+            if self.frontend in events:
+                self.handle_request(self.frontend.recv_multipart(), now)
+
+            self.expire_requests(now)
+            self.check_in_flight(now)
+            self.dispatch(now)
+            self.stats['queue_depth'] = len(self.queue)
+            self.stats['in_flight'] = self.in_flight is not None
+
+    def stop(self):
+        self.stop_thread = 1
+
+    def reply(self, envelope, message):
+        self.frontend.send_multipart(envelope + [message])
+
+    @staticmethod
+    def split_envelope(frames):
+        """
+        Split message into (routing envelope, body) at the first empty delimiter frame.
+        Envelope includes the delimiter, and is everything that has to be echoed back for the reply
+        to reach the client: identity added by ROUTER, plus eg. the request id of a correlated REQ.
+        Returns (None, None) if there is no delimiter.
+        """
+        for i, frame in enumerate(frames):
+            if not frame:
+                return frames[:i + 1], frames[i + 1:]
+        return None, None
+
+    def handle_request(self, frames, now):
+        """Admit a request from a client into the queue or reject it immediately."""
+        envelope, body = self.split_envelope(frames)
+        if envelope is None:
+            logging.warning('Dropping request without envelope delimiter from %s.', frames[0].hex())
+            return
+        # Client identity (prepended by ROUTER) is used to rate limit
+        identity = envelope[0]
+
+        if body[:1] == [STATS_COMMAND]:
+            self.reply(envelope, json.dumps(self.stats).encode())
+            return
+
+        if self.rate_limit:
+            bucket = self.buckets.get(identity)
+            if bucket is None:
+                self.prune_buckets(now)
+                bucket = self.buckets[identity] = TokenBucket(self.rate_limit, self.rate_burst)
+            if not bucket.consume(now):
+                self.stats['rejected_rate'] += 1
+                logging.warning('Client %s rate limited.', identity.hex())
+                self.reply(envelope, RATE_LIMITED)
+                return
+
+        if len(self.queue) >= self.queue_depth:
+            self.stats['rejected_busy'] += 1
+            logging.warning('Request queue full (%s) - rejecting request.', self.queue_depth)
+            self.reply(envelope, BUSY)
+            return
+
+        self.queue.append((now, envelope, body))
+
+    def prune_buckets(self, now, idle=60):
+        """Forget clients that have not sent anything recently (REQ identities change on reconnect)."""
+        for identity in [i for i, b in self.buckets.items() if now - b.last > idle]:
+            del self.buckets[identity]
+
+    def handle_response(self, frames):
+        """Route the serial worker's reply back to the client that sent the request."""
+        # DEALER receives the envelope REP echoed back, followed by the reply
+        envelope, body = self.split_envelope(frames)
+        if envelope is None or envelope != self.in_flight:
+            # Late reply to a request that was already answered with TIMEOUT
+            logging.warning('Discarding late reply from serial worker.')
+            return
+        self.frontend.send_multipart(envelope + body)
+        self.in_flight = None
+
+    def check_in_flight(self, now):
+        """Answer the in flight request with TIMEOUT if the serial worker has not replied in time."""
+        if self.in_flight is None or now - self.in_flight_since <= self.request_timeout:
+            return
+        self.stats['timed_out'] += 1
+        logging.warning('Serial worker did not reply to request from %s in time.', self.in_flight[0].hex())
+        self.reply(self.in_flight, TIMEOUT)
+        self.in_flight = None
+
+    def expire_requests(self, now):
+        """Reject requests that have sat in the queue for longer than max_age."""
+        if not self.max_age:
+            return
+        while self.queue and now - self.queue[0][0] > self.max_age:
+            _, envelope, _ = self.queue.popleft()
+            self.stats['expired'] += 1
+            logging.warning('Request from %s expired in queue.', envelope[0].hex())
+            self.reply(envelope, EXPIRED)
+
+    def dispatch(self, now):
+        """Forward the oldest queued request if the serial worker is idle."""
+        if self.in_flight is not None or not self.queue:
+            return
+        _, envelope, body = self.queue.popleft()
+        # REP worker treats all frames up to the delimiter as its envelope and echoes them back
+        self.backend.send_multipart(envelope + body)
+        self.in_flight = envelope
+        self.in_flight_since = now
+        self.stats['forwarded'] += 1
@@ -4,3 +4,35 @@ from ammcon import LOCAL_PATH
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 LOG_PATH = os.path.join(LOCAL_PATH, 'logs')
 SERIAL_PORT = '/dev/ttyUSB0'
+
+# Broker admission control
+BROKER_QUEUE_DEPTH = 16  # max requests waiting for the serial worker
+BROKER_RATE_LIMIT = 5.0  # requests/second per client (0 to disable)
+BROKER_RATE_BURST = 10  # requests a client may send in a burst
+BROKER_MAX_AGE = 10.0  # seconds a request may wait in the queue (0 to disable)
+BROKER_REQUEST_TIMEOUT = 5.0  # seconds the serial worker has to reply to a forwarded request
+
+# Telemetry (sensor readings published by serial worker)
+TELEMETRY_PORT = 7777
+
+# Seconds that a device's acknowledged state is trusted for (0 to always send commands)
+SHADOW_FRESHNESS = 30
+
+# Serial link: rate used at startup, and higher rates to try negotiating with the microcontroller
+SERIAL_BAUDRATE = 115200
+SERIAL_BAUDRATES = (921600, 460800, 230400)
+
+# Wake-On-LAN
+WOL_BROADCAST = '255.255.255.255'
+WOL_REPEAT = 3  # bursts of magic packets sent per request
+
+# Temperature logging. Adaptive mode polls between the min/max intervals and only stores readings
+# that change by more than the deadband, plus a heartbeat reading
+TEMP_INTERVAL = 60  # seconds
+TEMP_MIN_INTERVAL = 10  # seconds
+TEMP_MAX_INTERVAL = 600  # seconds
+TEMP_DEADBAND = 0.2  # degC
+HUMIDITY_DEADBAND = 1.0  # %RH
+TEMP_HEARTBEAT = 3600  # seconds
+TEMP_COMMAND = 'temp'  # command used to poll sensors
+TEMP_BULK_COMMAND = 'temp all'  # used instead with --bulk-readout, needs hub firmware with bulk readout support
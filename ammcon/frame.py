@@ -0,0 +1,111 @@
+"""Received microcontroller frames.
+
+Frame layout (after destuffing):
+    [HDR] [ACK] [DESC] [PAYLOAD] [CRC] [END]
+    1byte 1byte 2bytes <18bytes  1byte 1byte
+
+Fields are memoryviews over the receive buffer, created on first access, so
+inspecting a frame does not copy any bytes.
+"""
+
+# Ammcon imports
+import ammcon.h_bytecmds as pcmd
+import ammcon.helpers as helpers
+
+# Smallest valid frame: HDR, ACK, DESC (2 bytes), CRC, END (empty payload)
+MIN_LENGTH = 6
+
+# Payload decoders: list of (DESC range, decoder function)
+_decoders = []
+
+
+def register_decoder(desc_range):
+    """Decorator registering a payload decoder for frames whose first DESC byte is in desc_range.
+    If ranges overlap, the decoder with the narrowest range is used.
+    """
+    def decorator(func):
+        _decoders.append((desc_range, func))
+        _decoders.sort(key=lambda item: len(item[0]))
+        return func
+    return decorator
+
+
+def decoder_for(desc):
+    """Return payload decoder for the given first DESC byte, or None if there isn't one."""
+    for desc_range, func in _decoders:
+        if desc in desc_range:
+            return func
+    return None
+
+
+class Frame(object):
+    """Destuffed frame received from the microcontroller."""
+    __slots__ = ('raw', '_view', '_desc', '_payload')
+
+    def __init__(self, raw):
+        # raw must not be resized after this, as memoryviews are held over it
+        self.raw = raw
+        self._view = None
+        self._desc = None
+        self._payload = None
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __repr__(self):
+        return '<Frame %s>' % helpers.print_bytearray(self.raw)
+
+    @property
+    def view(self):
+        if self._view is None:
+            self._view = memoryview(self.raw)
+        return self._view
+
+    @property
+    def is_valid(self):
+        """True if frame is long enough to contain all fields."""
+        return len(self.raw) >= MIN_LENGTH
+
+    @property
+    def ack(self):
+        return self.view[1:2]
+
+    @property
+    def is_ack(self):
+        return self.raw[1] == pcmd.ack[0]
+
+    @property
+    def desc(self):
+        if self._desc is None:
+            self._desc = self.view[2:4]
+        return self._desc
+
+    @property
+    def payload(self):
+        if self._payload is None:
+            self._payload = self.view[4:-2]
+        return self._payload
+
+    @property
+    def crc(self):
+        return self.view[-2:-1]
+
+    @property
+    def crc_region(self):
+        """Payload plus received CRC. CRC calculated over this is 0 if the frame is intact."""
+        return self.view[4:-1]
+
+    def decode(self):
+        """Decode payload using the decoder registered for this frame's DESC.
+        Returns None if no decoder is registered.
+        """
+        func = decoder_for(self.raw[2])
+        if func is None:
+            return None
+        return func(self.payload)
+
+
+register_decoder(pcmd.temp_desc)(helpers.temp_payload)
+register_decoder(pcmd.bulk_temp_desc)(helpers.bulk_temp_payload)
+register_decoder(pcmd.buffered_temp_desc)(helpers.buffered_temp_payload)
+register_decoder(pcmd.light_desc)(helpers.light_state)
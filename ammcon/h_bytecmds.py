@@ -9,6 +9,37 @@ nak = b'\x15'
 poly = 0xE7
 init = 0x5A
 
+# Link negotiation (see SerialManager.negotiate_baudrate):
+#  'baud' + index into baud_rates: propose rate. Microcontroller ACKs at the old rate, then switches and
+#      reverts to the safe rate (baud_rates[0]) if it sees no frame within link_revert_timeout.
+#      Sending the same proposal again at the new rate confirms it. Whether confirmed or not, the
+#      microcontroller also reverts to the safe rate as soon as it sees a bad frame at a higher rate.
+#  'echo' + payload: microcontroller responds with the payload unchanged, used to verify the link.
+baud_rates = (115200, 230400, 460800, 921600, 1000000, 2000000, 3000000)
+link_commands = {'baud': b'\xF0', 'echo': b'\xF1\x00'}
+link_revert_timeout = 1
+
+# DESC (first byte) ranges of responses
+light_desc = range(0xB0, 0xC0)
+temp_desc = range(0xD0, 0xE0)
+# Bulk readout: current values of all sensors in one frame / block of samples buffered by the hub
+# for one sensor (second DESC byte is the sensor, as for single temperature commands)
+bulk_temp_desc = range(0xDA, 0xDB)
+buffered_temp_desc = range(0xDB, 0xDC)
+
+# DESC (first byte) of frames sent by the microcontroller on its own initiative, eg. status changes
+event_desc = range(0xE0, 0xF0)
+
+# First DESC byte of single temperature sensor responses
+sensor_desc = 0xD1
+
+# Temperature sensors, keyed by DESC of their responses: (telemetry topic name, DB device id)
+sensor_devices = {
+    b'\xD1\x00': ('living', 1),
+    b'\xD1\x01': ('bedroom2', 2),
+    b'\xD1\x02': ('bedroom3', 3),
+}
+
 # Define byte commands used to communicate commands to microcontroller
 #  AC = aircon
 #  Bx = lighting
@@ -28,6 +59,10 @@ micro_commands = {
     'templiving': b'\xD1',
     'tempbedroom2': b'\xD1\x01',
     'tempbedroom3': b'\xD1\x02',
+    'temp all': b'\xDA\x00',
+    'temp buffered living': b'\xDB\x00',
+    'temp buffered bedroom2': b'\xDB\x01',
+    'temp buffered bedroom3': b'\xDB\x02',
 
     'bedroom off': b'\xB1\x00',
     'bedroom on': b'\xB1\x01',
@@ -74,3 +109,23 @@ micro_commands = {
     'tv mute': b'\xC1\x01',
     'tv switch': b'\xC1\x02'
 }
+
+# Commands handled by the serial worker itself rather than sent to the microcontroller.
+#  'wol': further message frames are MAC addresses to send Wake-On-LAN packets to.
+local_commands = {
+    'wol': b'wol',
+}
+
+# Set-state commands which can be skipped if the device is already known to be in that state.
+# Relative commands (up/down) and TV commands (IR toggles) are not idempotent so are always sent.
+idempotent_commands = {cmd for name, cmd in micro_commands.items()
+                       if len(cmd) == 2
+                       and (cmd[0] in light_desc or ' AC ' in name)
+                       and not name.endswith((' up', ' down'))}
+
+# Devices whose state is changed by commands to another device (first DESC byte)
+linked_devices = {
+    0xB4: (0xB6,),
+    0xB5: (0xB6,),
+    0xB6: (0xB4, 0xB5),
+}
@@ -21,12 +21,40 @@ def temp_str(response):
 
 def temp_val(response):
     """Return values of temperature and humidity from microcontroller response."""
-    payload = response[4:-2]
-    temp = int(payload[0]) + 0.01 * int(payload[1])
-    humidity = int(payload[2]) + 0.01 * int(payload[3])
+    return temp_payload(memoryview(response)[4:-2])
+
+
+def temp_payload(payload):
+    """Return values of temperature and humidity from the payload of a temperature response."""
+    temp = payload[0] + 0.01 * payload[1]
+    humidity = payload[2] + 0.01 * payload[3]
     return temp, humidity
 
 
+def bulk_temp_payload(payload):
+    """Return list of (sensor, temperature, humidity) from the payload of a bulk temperature response.
+    Payload: [COUNT] then COUNT records of [SENSOR] [TEMP] [TEMP/100] [RH] [RH/100]
+    """
+    return [(payload[i], payload[i + 1] + 0.01 * payload[i + 2], payload[i + 3] + 0.01 * payload[i + 4])
+            for i in range(1, 1 + 5 * payload[0], 5)]
+
+
+def buffered_temp_payload(payload):
+    """Return (sensor, interval, [(temperature, humidity), ...]) from the payload of a buffered samples response.
+    Samples are oldest first, taken every INTERVAL seconds, the last one being the current value.
+    Payload: [SENSOR] [INTERVAL] [COUNT] then COUNT samples of [TEMP] [TEMP/100] [RH] [RH/100]
+    """
+    samples = [temp_payload(payload[i:i + 4]) for i in range(3, 3 + 4 * payload[2], 4)]
+    return payload[0], payload[1], samples
+
+
+def light_state(payload):
+    """Return state byte set by a light command, from the payload of its response.
+    Microcontroller echoes the state byte back inverted.
+    """
+    return ~payload[0] & 0xFF
+
+
 def print_bytearray(input_bytearray):
     """Return printable version of a bytearray."""
     if input_bytearray:
@@ -34,24 +62,81 @@ def print_bytearray(input_bytearray):
     return b''
 
 
+class HexDump(object):
+    """Wraps bytes passed as a logging argument, so that the printable version is only
+    built if the record is actually emitted (ie. not at all when DEBUG is disabled).
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return str(print_bytearray(self.data))
+
+
+class MagicPacketSender(object):
+    """Send Wake-On-LAN packets to many hosts from a single broadcast socket.
+    Magic packets are built once per MAC address and reused.
+    """
+
+    def __init__(self, broadcast_address='255.255.255.255', port=9):
+        self.address = (broadcast_address, port)
+        self.packets = {}
+        # Create an IPv4, UDP socket
+        self.sock = socket(family=AF_INET, type=SOCK_DGRAM)
+        # Enable sending datagrams to broadcast addresses
+        self.sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def magic_packet(self, mac_address):
+        """Return (cached) 102 byte magic packet for the specified MAC address."""
+        packet = self.packets.get(mac_address)
+        if packet is None:
+            mac_bytes = bytes.fromhex(mac_address.replace(':', '').replace('-', ''))
+            if len(mac_bytes) != 6:
+                raise ValueError('Invalid MAC address: {}'.format(mac_address))
+            packet = self.packets[mac_address] = b'\xFF' * 6 + mac_bytes * 16
+        return packet
+
+    def send(self, mac_addresses, repeat=1):
+        """Send magic packets to all of the specified MAC addresses, in `repeat` back-to-back bursts.
+        Doesn't sleep between bursts, so it can be called from the serial worker thread without holding it up.
+        Returns dict of MAC address -> 'ACK' (all packets fully sent) or 'NAK'.
+        """
+        status = {}
+        packets = []
+        for mac_address in mac_addresses:
+            try:
+                packets.append((mac_address, self.magic_packet(mac_address)))
+                status[mac_address] = 'ACK'
+            except ValueError:
+                status[mac_address] = 'NAK'
+
+        for _ in range(repeat):
+            for mac_address, packet in packets:
+                try:
+                    sent = self.sock.sendto(packet, self.address)
+                except OSError:
+                    sent = 0
+                # Fail: not all bytes of the magic packet were sent
+                if sent != len(packet):
+                    status[mac_address] = 'NAK'
+        return status
+
+    def close(self):
+        self.sock.close()
+
+
 def send_magic_packet(mac_address, broadcast_address, port=9):
     """Send Wake-On-LAN packet to the specified MAC address."""
-    # Create an IPv4, UDP socket
-    sock = socket(family=AF_INET, type=SOCK_DGRAM)
-    # Enable sending datagrams to broadcast addresses
-    sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
-    # Build magic packet
-    mac_address = bytes.fromhex(mac_address.replace(':', ''))
-    magic_packet = b'\xFF' * 6 + mac_address * 16
-    # Send magic packet
-    result = sock.sendto(magic_packet, (broadcast_address, port))
-    # Success: sent all 102 bytes of the magic packet
-    if result == len(magic_packet):
-        ack = 'ACK'
-    # Fail: not all bytes were sent
-    else:
-        ack = 'NAK'
-    return ack
+    with MagicPacketSender(broadcast_address, port) as sender:
+        return sender.send([mac_address])[mac_address]
 
 
 def current_time():
@@ -64,3 +64,47 @@ class TemperatureSchema(ModelSchema):
         if many:
             return {'data': data}
         return data
+
+
+def temperature_series(session, device_id, start, end, step=None, max_gap=None):
+    """ Reconstruct step-wise (sample-and-hold) temperature/humidity series for a device between start and end (UTC).
+
+        Readings are only stored when they change by more than the deadband (plus heartbeats), so a stored
+        value holds until the next stored reading. The value in effect at `start` is taken from the last
+        reading before it. Returns list of (datetime, temperature, humidity):
+          - step=None: a point at start, each stored reading in (start, end], and a point at end.
+          - step=timedelta: a point every step from start to end.
+        If max_gap (timedelta) is given, points whose held value is older than that are (datetime, None, None),
+        eg. when the logger was not running.
+    """
+    query = session.query(Temperature).filter(Temperature.device_id == device_id)
+    previous = query.filter(Temperature.datetime <= start).order_by(Temperature.datetime.desc()).first()
+    readings = query.filter(Temperature.datetime > start,
+                            Temperature.datetime <= end).order_by(Temperature.datetime).all()
+    if previous is not None:
+        readings.insert(0, previous)
+
+    if step is None:
+        times = [start] + [reading.datetime for reading in readings if reading.datetime > start]
+        if times[-1] != end:
+            times.append(end)
+    else:
+        times = []
+        time = start
+        while time <= end:
+            times.append(time)
+            time += step
+
+    series = []
+    held = None
+    i = 0
+    for time in times:
+        # Advance to the last reading at or before this time
+        while i < len(readings) and readings[i].datetime <= time:
+            held = readings[i]
+            i += 1
+        if held is None or (max_gap is not None and time - held.datetime > max_gap):
+            series.append((time, None, None))
+        else:
+            series.append((time, held.temperature, held.humidity))
+    return series
@@ -0,0 +1,152 @@
+"""Profilers for the background worker's threads.
+
+Both measure per-thread CPU time rather than wall-clock time, so time the threads
+spend blocked waiting (zmq poll, Queue.get, serial reads) doesn't drown out the
+code actually using the CPU (framing, CRC, ORM, logging etc.).
+
+StackSampler: samples the stack of each thread and weights it by the CPU time the
+    thread used since the previous sample. Written in collapsed-stack format (one
+    'frame;frame;frame microseconds' line per unique stack), which can be fed straight
+    into flamegraph.pl/speedscope etc.
+ThreadProfiler: cProfile for every thread started after it is installed, written as
+    one pstats file per thread.
+"""
+
+# Python Standard Library imports
+import cProfile
+import functools
+import logging
+import os.path
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def thread_filename(thread, extension):
+    """Return filename for the results of the given thread, eg. 'SerialManager_Thread-2.collapsed'."""
+    name = '{}_{}'.format(type(thread).__name__, thread.name)
+    return '{}.{}'.format(re.sub(r'[^\w.-]', '_', name), extension)
+
+
+class StackSampler(threading.Thread):
+    """Thread which samples stacks of the given threads, weighted by CPU time, until stopped or duration expires.
+
+    threads: threads to profile (may not have been started yet).
+    output_dir: directory that a .collapsed file per thread is written to.
+    interval: seconds between samples.
+    duration: seconds to profile for, 0 to profile until stop() is called.
+    """
+
+    def __init__(self, threads, output_dir, interval=0.005, duration=0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.threads = threads
+        self.output_dir = output_dir
+        self.interval = interval
+        self.duration = duration
+        self.done = threading.Event()
+        self.counts = {thread: Counter() for thread in threads}
+
+    def run(self):
+        logging.info('Profiling %s threads, writing to %s', len(self.threads), self.output_dir)
+        deadline = time.monotonic() + self.duration
+        last_cpu_time = {}
+        while not self.done.wait(self.interval):
+            if self.duration and time.monotonic() > deadline:
+                break
+            frames = sys._current_frames()  # pylint: disable=W0212
+            for thread in self.threads:
+                cpu_time = self.thread_cpu_time(thread)
+                if cpu_time is None:
+                    continue
+                used = cpu_time - last_cpu_time.get(thread, cpu_time)
+                last_cpu_time[thread] = cpu_time
+                frame = frames.get(thread.ident)
+                # Threads blocked waiting use no CPU time, so their stacks aren't counted
+                if used > 0 and frame is not None:
+                    self.counts[thread][self.collapse(frame)] += used
+        self.write()
+
+    def stop(self):
+        """Stop sampling and wait for results to be written."""
+        self.done.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    @staticmethod
+    def thread_cpu_time(thread):
+        """Return CPU time (seconds) used so far by thread, or None if it isn't running."""
+        if thread.ident is None or not thread.is_alive():
+            return None
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+        except OSError:
+            return None
+
+    @staticmethod
+    def collapse(frame):
+        """Return stack of frame as 'outermost;...;innermost' string of file:function entries."""
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        for thread, counts in self.counts.items():
+            output_path = os.path.join(self.output_dir, thread_filename(thread, 'collapsed'))
+            with open(output_path, 'w') as f:
+                for stack, cpu_time in counts.most_common():
+                    # Weight in microseconds of CPU time
+                    microseconds = int(round(cpu_time * 1e6))
+                    if microseconds:
+                        f.write('{} {}\n'.format(stack, microseconds))
+            logging.info('Wrote %.3fs of CPU time for %s to %s', sum(counts.values()), thread.name, output_path)
+
+
+class ThreadProfiler(object):
+    """cProfile every thread started after install(), timing with each thread's own CPU time.
+
+    Threads are profiled from their first instruction, so install() must be called before the
+    threads to profile are started. Per-thread profilers need Python < 3.12, as from 3.12 cProfile
+    can only have one profiler active in the whole interpreter.
+    Note: profiled threads keep paying the profiling overhead after stop() until they exit.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.profilers = {}
+
+    def install(self):
+        if sys.version_info >= (3, 12):
+            raise RuntimeError('Per-thread cProfile needs Python < 3.12.')
+        logging.info('Profiling threads started from now on, writing to %s', self.output_dir)
+        threading.setprofile(self.start_thread)
+
+    def start_thread(self, frame, event, arg):
+        """Profile function set for new threads: called once at thread start, replaces itself with cProfile."""
+        # Timer reads this thread's CPU clock even when stats are collected from another thread.
+        # It must not run any Python code, else the GIL could switch to this thread mid-collection.
+        clock_id = time.pthread_getcpuclockid(threading.get_ident())
+        profiler = cProfile.Profile(functools.partial(time.clock_gettime, clock_id))
+        with self.lock:
+            self.profilers[threading.current_thread()] = profiler
+        profiler.enable()
+
+    def stop(self):
+        """Stop profiling new threads and write a pstats file for each profiled thread."""
+        threading.setprofile(None)
+        with self.lock:
+            profilers, self.profilers = self.profilers, {}
+        if not profilers:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        for thread, profiler in profilers.items():
+            output_path = os.path.join(self.output_dir, thread_filename(thread, 'pstats'))
+            profiler.dump_stats(output_path)
+            logging.info('Wrote profile of %s to %s', thread.name, output_path)
@@ -1,7 +1,10 @@
 # Python Standard Library imports
+import json
 import logging
-from threading import Thread
-from time import sleep
+import os
+from queue import Empty, Queue
+from threading import Condition, Lock, Thread
+from time import monotonic, sleep, time
 # Third party imports
 import serial
 import zmq
@@ -9,6 +12,18 @@ from crccheck.crc import Crc
 # Ammcon imports
 import ammcon.h_bytecmds as pcmd
 import ammcon.helpers as helpers
+from ammcon.frame import Frame
+from ammcon.shadow import FORCE, DeviceShadow
+from ammcon.telemetry import TelemetryPublisher
+
+# One compact record per command handled, see log_command()
+command_log = logging.getLogger('ammcon.commands')
+
+
+def log_command(command, status, started):
+    """Log compact, structured record of a handled command: hex command, result and round trip time."""
+    if command_log.isEnabledFor(logging.INFO):
+        command_log.info('cmd=%s status=%s rtt_ms=%.1f', command.hex(), status, (monotonic() - started) * 1000)
 
 
 class SerialManager(Thread):
@@ -21,14 +36,27 @@ class SerialManager(Thread):
            or whatever else by abstracting it away
     """
 
-    def __init__(self, port):
+    def __init__(self, port, telemetry_port=7777, response_timeout=2, shadow_freshness=30, baudrate=115200,
+                 baudrates=(), wol_broadcast='255.255.255.255', wol_repeat=3):
         """ Port: Linux using FTDI USB adaptor; '/dev/ttyUSB0' should be OK.
             Linux using rPi GPIO Rx/Tx pins; '/dev/ttyAMA0'
             Windows using USB adaptor or serial port; 'COM1', 'COM2, etc.
+            telemetry_port: port that decoded sensor readings are published on.
+            response_timeout: seconds to wait for the microcontroller to respond to a command.
+            shadow_freshness: seconds an acknowledged device state is trusted for, during
+                              which repeated set-state commands are answered from cache.
+            baudrate: safe rate that the link is opened at.
+            baudrates: higher rates to try negotiating with the microcontroller at startup.
+            wol_broadcast: address Wake-On-LAN packets are sent to.
+            wol_repeat: bursts of Wake-On-LAN packets sent per request.
         """
         Thread.__init__(self)
         self.daemon = False  # Need thread to block
         self.stop_thread = 0  # Flag used to gracefully exit thread
+        self.response_timeout = response_timeout
+        self.shadow = DeviceShadow(freshness=shadow_freshness)
+        self.wol_repeat = wol_repeat
+        self.wol = helpers.MagicPacketSender(wol_broadcast)
 
         # Setup CRC calculator instance. Used to check CRC of response messages
         self.crc_calc = CRC(width=8,
@@ -40,7 +68,10 @@ class SerialManager(Thread):
         self.socket = context.socket(zmq.REP)
         self.socket.connect("tcp://127.0.0.1:6666")
 
-        self.ser = self.open_serial_port(port)
+        # Setup zeroMQ PUB socket for publishing sensor readings to subscribers
+        self.telemetry = TelemetryPublisher(telemetry_port)
+
+        self.ser = self.open_serial_port(port, baudrate)
 
         # Give microcontroller time to startup (esp. if has bootloader on it)
         sleep(2)
@@ -48,48 +79,243 @@ class SerialManager(Thread):
         # Flush input buffer (discard all contents) just in case
         self.ser.reset_input_buffer()
 
+        # Reader thread continuously drains the serial port and routes frames by DESC
+        self.reader = SerialReader(self.ser)
+
+        # Switch to the fastest rate that both sides can reliably use (reader thread not started yet)
+        self.link_stats = {'baudrate': baudrate, 'bytes_per_second': None}
+        self.negotiate_baudrate(baudrates)
+
     def run(self):
+        self.reader.start()
+
         # Keep looping, waiting for next request from zeromq client
         while self.stop_thread != 1:
-            # Wait for next request from client (on ZMQ socket)
-            command = self.socket.recv()
+            # Publish any unsolicited frames (eg. device-initiated status) while waiting
+            self.publish_events()
+
+            # Wait for next request from client (on ZMQ socket). Poll so that events are not held up.
+            if not self.socket.poll(100):
+                continue
+            # Message is the command, optionally followed by FORCE to bypass the device shadow
+            message = self.socket.recv_multipart()
+            started = monotonic()
+            command = message[0]
             logging.debug('Received command in queue: %s', command)
 
+            if not command:
+                logging.warning('Empty command received - ignoring.')
+                self.socket.send('invalid command'.encode())
+                log_command(command, 'invalid', started)
+                continue
+
+            # Commands not meant for the microcontroller
+            if command == pcmd.local_commands['wol']:
+                self.socket.send(self.wake_hosts(message[1:]))
+                log_command(command, 'local', started)
+                continue
+
+            # Skip commands which wouldn't change the device's state
+            if FORCE not in message[1:]:
+                cached = self.shadow.cached_response(command)
+                if cached is not None:
+                    self.socket.send(cached)
+                    log_command(command, 'cached', started)
+                    continue
+
+            # Register for the response before sending so that it can't be missed
+            response_queue = self.reader.expect(command)
+
             # Send command to microcontroller (over serial port)
             self.send_command(command)
 
-            # sleep(0.3)  # debugging empty response issue. shouldn't need this
-
-            # Read in response from microcontroller
-            # raw_response = self.get_response()  # unreliable
-            raw_response = self.get_response_until()  # may block forever
-            logging.debug('Raw response: %s', helpers.print_bytearray(raw_response))
-
-            # Destuff response
-            # Response should be in the following format:
-            # [HDR] [ACK] [DESC] [PAYLOAD] [CRC] [END]
-            # 1byte 1byte 2bytes <18bytes  1byte 1byte
-            #response = self.destuff_bytes(raw_response, method='PPP')
-            response = raw_response
-            logging.debug('Destuffed   : %s', helpers.print_bytearray(response))
+            # Wait for reader thread to hand over the response from microcontroller
+            try:
+                frame = response_queue.get(timeout=self.response_timeout)
+            except Empty:
+                logging.warning('No response from microcontroller for command: %s', helpers.HexDump(command))
+                self.shadow.invalidate(command[0])
+                self.socket.send('timeout'.encode())
+                log_command(command, 'timeout', started)
+                continue
+            finally:
+                # Response arriving after this point (or since the timeout) is counted as stale by the reader
+                self.reader.cancel(command, response_queue)
+            # Frame has already been destuffed by the reader
+            logging.debug('Response: %s', helpers.HexDump(frame.raw))
 
             # Check CRC of destuffed command
-            if not self.crc_calc.check_crc(response[4:-1]):
-                logging.warning('Invalid CRC received: %s', response[-2:-1])
+            if not frame.is_valid or not self.crc_calc.check_crc(frame.crc_region):
+                logging.warning('Invalid CRC received: %s', helpers.HexDump(frame.raw))
+                self.shadow.invalidate(command[0])
                 response = 'invalid CRC'.encode()
+                status = 'crc'
+            else:
+                self.shadow.update(command, frame)
+                self.publish_telemetry(frame)
+                response = frame.raw
+                status = 'ack' if frame.is_ack else 'nak'
 
             # Send response back to client
             self.socket.send(response)
+            log_command(command, status, started)
 
     def stop(self):
         self.stop_thread = 1
+        self.reader.stop()
+
+    def wake_hosts(self, mac_addresses):
+        """Send Wake-On-LAN packets to the given MAC addresses, return JSON encoded status of each host."""
+        mac_addresses = [mac_address.decode(errors='replace') for mac_address in mac_addresses]
+        status = self.wol.send(mac_addresses, repeat=self.wol_repeat)
+        logging.info('Wake-On-LAN sent: %s', status)
+        return json.dumps(status).encode()
+
+    def publish_events(self):
+        """Publish unsolicited frames received from the microcontroller."""
+        while True:
+            try:
+                frame = self.reader.events.get_nowait()
+            except Empty:
+                break
+            if not frame.is_valid or not self.crc_calc.check_crc(frame.crc_region):
+                logging.warning('Invalid CRC received in event: %s', helpers.HexDump(frame.raw))
+                continue
+            # Device state changed on the microcontroller's side. Event DESCs don't say which device, so forget all.
+            self.shadow.clear()
+            self.telemetry.publish_event(frame.desc, frame.payload)
+
+    def publish_telemetry(self, frame):
+        """Publish sensor readings contained in a (CRC checked) response frame.
+        Bulk and buffered responses are split into one reading per sensor/sample.
+        """
+        if not frame.is_ack or frame.desc[0] not in pcmd.temp_desc:
+            return
+        try:
+            decoded = frame.decode()
+        except IndexError:
+            logging.warning('Temperature response too short: %s', helpers.HexDump(frame.raw))
+            return
+
+        desc = frame.desc[0]
+        if desc in pcmd.bulk_temp_desc:
+            for sensor, temp, humidity in decoded:
+                self.telemetry.publish_reading(bytes([pcmd.sensor_desc, sensor]), temp, humidity)
+        elif desc in pcmd.buffered_temp_desc:
+            sensor, interval, samples = decoded
+            now = time()
+            for age, (temp, humidity) in enumerate(reversed(samples)):
+                self.telemetry.publish_reading(bytes([pcmd.sensor_desc, sensor]), temp, humidity,
+                                               timestamp=now - age * interval)
+        else:
+            temp, humidity = decoded
+            self.telemetry.publish_reading(frame.desc, temp, humidity)
+
+    def transact(self, command, timeout=0.5):
+        """
+        Send command and return its (CRC checked) response frame, or None if no response within timeout.
+        Reads the serial port directly, so must only be used before the reader thread is started.
+        """
+        self.send_command(command)
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            data = self.ser.read(size=max(1, self.ser.in_waiting))
+            expected = self.reader.response_desc(command)
+            for frame in self.reader.feed(data):
+                if (frame.is_valid and frame.desc[:len(expected)] == expected
+                        and self.crc_calc.check_crc(frame.crc_region)):
+                    return frame
+                logging.debug('Discarding frame during link setup: %s', helpers.HexDump(frame.raw))
+        return None
+
+    def probe_link(self, burst=8, size=16):
+        """
+        Send a burst of echo frames and check each comes back intact.
+        Returns achieved throughput (bytes/second, both directions), or None if any echo failed.
+        """
+        transferred = 0
+        started = monotonic()
+        for _ in range(burst):
+            payload = os.urandom(size)
+            command = pcmd.link_commands['echo'] + payload
+            frame = self.transact(command)
+            if frame is None or not frame.is_ack or frame.payload != payload:
+                return None
+            transferred += len(command) + len(frame)
+        return transferred / (monotonic() - started)
+
+    def negotiate_baudrate(self, baudrates, burst=8):
+        """
+        Try each of the given rates (fastest first): propose it to the microcontroller with a handshake,
+        switch, verify with a burst of echo frames, then confirm. Falls back to the current (safe) rate
+        if verification fails. Returns the rate in use, throughput is recorded in link_stats.
+        """
+        safe = self.ser.baudrate
+        timeout = self.ser.timeout
+        self.ser.timeout = 0.05  # Short reads, so transact() can keep to its own deadline
+        try:
+            for baudrate in sorted(baudrates, reverse=True):
+                if baudrate <= safe or baudrate not in pcmd.baud_rates:
+                    continue
+                handshake = pcmd.link_commands['baud'] + bytes([pcmd.baud_rates.index(baudrate)])
+                frame = self.transact(handshake)
+                if frame is None or not frame.is_ack:
+                    logging.info('Microcontroller refused %s baud.', baudrate)
+                    continue
+
+                self.ser.baudrate = baudrate
+                bytes_per_second = self.probe_link(burst)
+                if bytes_per_second is not None and self.confirm_baudrate(handshake):
+                    self.link_stats = {'baudrate': baudrate, 'bytes_per_second': bytes_per_second}
+                    logging.info('Serial link running at %s baud, %.0f bytes/s.', baudrate, bytes_per_second)
+                    return baudrate
+
+                logging.warning('Serial link unreliable at %s baud, falling back to %s baud.', baudrate, safe)
+                self.ser.baudrate = safe
+                self.resync_link()
+
+            bytes_per_second = self.probe_link(burst)
+            self.link_stats = {'baudrate': safe, 'bytes_per_second': bytes_per_second}
+            if bytes_per_second is None:
+                logging.error('Serial link not working at %s baud.', safe)
+            else:
+                logging.info('Serial link running at %s baud, %.0f bytes/s.', safe, bytes_per_second)
+            return safe
+        finally:
+            self.ser.timeout = timeout
+
+    def confirm_baudrate(self, handshake, attempts=3):
+        """
+        Confirm proposed rate by repeating the handshake at the new rate. Retried, as if only the ACK
+        got lost, the microcontroller has already confirmed and won't revert on its own.
+        """
+        for _ in range(attempts):
+            if self.transact(handshake) is not None:
+                return True
+        return False
+
+    def resync_link(self, attempts=3):
+        """
+        Get back in sync with the microcontroller at the safe rate after a failed negotiation.
+        Microcontroller reverts after link_revert_timeout if it never confirmed the new rate, or on
+        the first (garbled to it) frame received if it had, so that frame may go unanswered.
+        """
+        for _ in range(attempts):
+            # Wait for microcontroller to give up on the new rate as well
+            sleep(pcmd.link_revert_timeout)
+            self.ser.reset_input_buffer()
+            self.reader.state = "WAIT_HDR"
+            if self.probe_link(burst=1) is not None:
+                return True
+        logging.error('Lost sync with microcontroller after link negotiation.')
+        return False
 
     @staticmethod
-    def open_serial_port(port):
+    def open_serial_port(port, baudrate=115200):
         # Attempt to open serial port.
         try:
             ser = serial.Serial(port=port,
-                                baudrate=115200,
+                                baudrate=baudrate,
                                 timeout=2,
                                 write_timeout=2)
             # Timeout is set, so reading from serial port may return less
@@ -115,39 +341,6 @@ class SerialManager(Thread):
             logging.error('Serial port not open - unable to read.')
         return read_byte
 
-    def get_response_until(self):
-        """
-        Read from serial input buffer until end_flag byte is received.
-        Note: for some reason pyserial's timeout doesn't work on these read
-              commands (tested on Windows and Linux), so this may block forever
-              if microcontroller doesn't response for whatever reason.
-        """
-
-        # TO DO: rewrite this as it will end prematurely if data byte contains end flag
-
-        recvd_command = b''
-        state = "WAIT_HDR"
-        while state != "RECV_END":
-            in_byte = self.ser.read(size=1)
-
-            if state == "WAIT_HDR":
-                if in_byte == pcmd.hdr:
-                    recvd_command += in_byte
-                    state = "IN_MSG"
-            elif state == "IN_MSG":
-                if in_byte == pcmd.esc:
-                    state = "RECV_ESC"
-                elif in_byte == pcmd.end:
-                    recvd_command += in_byte
-                    state = "RECV_END"
-                else:
-                    recvd_command += in_byte
-            elif state == "RECV_ESC":
-                recvd_command += in_byte
-                state = "IN_MSG"
-
-        return recvd_command
-
     def get_response(self):
         """
         Read in microcontroller response from serial input buffer.
@@ -283,23 +476,180 @@ class SerialManager(Thread):
         # Wait until all data is written
         self.ser.flush()
 
-        logging.info('Command sent to microcontroller: %s', helpers.print_bytearray(command_array))
+        logging.debug('Command sent to microcontroller: %s', helpers.HexDump(command_array))
 
     def close(self):
         """ Close connection to the serial port."""
+        self.reader.join()
         self.ser.close()
+        self.telemetry.close()
+        self.wol.close()
 
 
-class VirtualSerialManager(SerialManager):
+class SerialReader(Thread):
+    """Thread which continuously drains the serial port's receive buffer.
+
+    Input is split into (destuffed) frames, which are then routed by their DESC:
+      - to the request waiting on a response with that DESC (see expect()),
+      - to the events queue if it is an unsolicited frame (pcmd.event_desc),
+      - otherwise counted as a stale frame (eg. a late response to a timed out command).
+    Reading continuously means stray or late frames can't be mistaken for the response
+    to the next command.
+    """
+
+    def __init__(self, ser):
+        Thread.__init__(self)
+        self.daemon = True
+        self.stop_thread = 0  # Flag used to gracefully exit thread
+
+        self.ser = ser
+        self.lock = Lock()
+        self.pending = {}  # Expected DESC (see response_desc()) -> queue of waiting request
+        self.events = Queue()
+        self.stats = {'frames': 0,
+                      'events': 0,
+                      'stale': 0}
+
+        # Framing state. Each frame is received into its own buffer, which the Frame then keeps.
+        self.state = "WAIT_HDR"
+        self.frame = bytearray()
+
+    def run(self):
+        while self.stop_thread != 1:
+            try:
+                # Read whatever is waiting (at least one byte, so that read blocks until timeout)
+                data = self.ser.read(size=max(1, self.ser.in_waiting))
+            except serial.SerialException:
+                # Attempted to read from closed port
+                logging.error('Serial port not open - unable to read.')
+                sleep(1)
+                continue
+            for frame in self.feed(data):
+                self.route(frame)
+
+    def stop(self):
+        self.stop_thread = 1
+
     @staticmethod
-    def open_serial_port(port):
-        return VirtualSerialPort()
+    def response_desc(command):
+        """
+        Return DESC that the response to command will have: the full 2 byte DESC, or only
+        the first byte for 1 byte commands (eg. 'temp'), whose response DESC isn't known in full.
+        """
+        return bytes(command[:2])
+
+    def expect(self, command):
+        """Register interest in the response to command. Returns queue the response frame will be put on."""
+        response_queue = Queue(maxsize=1)
+        with self.lock:
+            self.pending[self.response_desc(command)] = response_queue
+        return response_queue
+
+    def cancel(self, command, response_queue=None):
+        """
+        Stop waiting for the response to command. If given the queue returned by expect(), a response
+        routed to it after the requester stopped waiting (eg. just after timing out) is counted as stale.
+        """
+        with self.lock:
+            self.pending.pop(self.response_desc(command), None)
+        if response_queue is None:
+            return
+        try:
+            frame = response_queue.get_nowait()
+        except Empty:
+            return
+        self.count_stale(frame)
+
+    def feed(self, data):
+        """
+        Run received bytes through the framing state machine, return list of completed Frames.
+        Escaped bytes are destuffed. Frames are in the following format:
+            [HDR] [ACK] [DESC] [PAYLOAD] [CRC] [END]
+            1byte 1byte 2bytes <18bytes  1byte 1byte
+        """
+        hdr, end, esc = pcmd.hdr[0], pcmd.end[0], pcmd.esc[0]
+        frames = []
+        for b in data:
+            if self.state == "WAIT_HDR":
+                if b == hdr:
+                    self.frame = bytearray((b,))
+                    self.state = "IN_MSG"
+            elif self.state == "IN_MSG":
+                if b == esc:
+                    self.state = "RECV_ESC"
+                elif b == end:
+                    self.frame.append(b)
+                    frames.append(Frame(self.frame))
+                    self.frame = bytearray()
+                    self.state = "WAIT_HDR"
+                else:
+                    self.frame.append(b)
+            elif self.state == "RECV_ESC":
+                self.frame.append(b)
+                self.state = "IN_MSG"
+        return frames
+
+    def route(self, frame):
+        self.stats['frames'] += 1
+        desc = bytes(frame.desc) if frame.is_valid else b''
+
+        with self.lock:
+            # Full DESC match, or first byte only for requests made with 1 byte commands
+            response_queue = self.pending.pop(desc, None) or self.pending.pop(desc[:1], None)
+        if response_queue is not None:
+            response_queue.put(frame)
+        elif desc and desc[0] in pcmd.event_desc:
+            self.stats['events'] += 1
+            self.events.put(frame)
+        else:
+            self.count_stale(frame)
+
+    def count_stale(self, frame):
+        """Discard a frame that no request is waiting for (eg. a late response to a timed out command)."""
+        with self.lock:
+            self.stats['stale'] += 1
+            stale = self.stats['stale']
+        logging.warning('Stale frame received (%s so far): %s', stale, helpers.HexDump(frame.raw))
+
+
+class VirtualSerialManager(SerialManager):
+    """SerialManager connected to an emulated microcontroller, for development and offline testing.
+
+    port_options: passed on to VirtualSerialPort, eg. max_baudrate, error_baudrate or
+                  lost_confirmations to exercise link negotiation.
+    """
+
+    def __init__(self, port, port_options=None, **kwargs):
+        self.port_options = port_options or {}
+        SerialManager.__init__(self, port, **kwargs)
+
+    def open_serial_port(self, port, baudrate=115200):
+        return VirtualSerialPort(baudrate=baudrate, **self.port_options)
 
 
 class VirtualSerialPort(object):
-    def __init__(self):
+    """Emulates the microcontroller on the other end of a serial port.
+
+    max_baudrate: highest rate the emulated microcontroller accepts during link negotiation.
+    error_baudrate: if set, echo frames get corrupted at this rate and above (to test fallback).
+    lost_confirmations: number of rate confirmation ACKs to lose (to test a lost ACK).
+    """
+
+    def __init__(self, timeout=0.1, baudrate=115200, max_baudrate=921600, error_baudrate=None,
+                 lost_confirmations=0):
         self._received = b''
         self.in_waiting = 0
+        self.timeout = timeout
+        self.baudrate = baudrate
+        self.max_baudrate = max_baudrate
+        self.error_baudrate = error_baudrate
+        self.lost_confirmations = lost_confirmations
+        # Emulated microcontroller's side of the link
+        self._device_baudrate = baudrate
+        self._trial = False  # True while new rate is not yet confirmed
+        self._last_valid = monotonic()
+        # Written to by serial manager thread, read by serial reader thread
+        self._condition = Condition()
 
         # TO DO: move CRC stuff to helper function
         # Setup CRC calculator instance. Used to check CRC of response messages
@@ -313,8 +663,49 @@ class VirtualSerialPort(object):
             Format: [HDR] [ACK] [DESC] [PAYLOAD] [CRC] [END]
                     1byte 1byte 2bytes <18bytes  1byte 1byte
         """
+        if not self._link_ok():
+            return
+        data = SerialManager._destuff_bytes_ppp(data)
+        switch_to = None
+
+        # Link negotiation: accept rate if supported, switching after the response is sent
+        if data[1:2] == pcmd.link_commands['baud']:
+            baudrate = pcmd.baud_rates[data[2]] if data[2] < len(pcmd.baud_rates) else None
+            if baudrate is not None and baudrate <= self.max_baudrate:
+                ack = pcmd.ack
+                if baudrate == self._device_baudrate:
+                    self._trial = False  # Confirmation at the new rate
+                    if self.lost_confirmations:
+                        self.lost_confirmations -= 1
+                        self._last_valid = monotonic()
+                        return
+                else:
+                    switch_to = baudrate
+            else:
+                ack = pcmd.nak
+            payload = bytes([data[2]])
+        # Link verification: echo payload back
+        elif data[1:3] == pcmd.link_commands['echo']:
+            ack = pcmd.ack
+            payload = data[3:-2]
+            if self.error_baudrate and self._device_baudrate >= self.error_baudrate:
+                payload = bytes([payload[0] ^ 0x01]) + payload[1:]
+        # Bulk readout: current values of all sensors
+        elif data[1] in pcmd.bulk_temp_desc:
+            ack = pcmd.ack
+            sensors = [desc[1] for desc in sorted(pcmd.sensor_devices)]
+            payload = bytes([len(sensors)])
+            for sensor in sensors:
+                payload += bytes([sensor]) + self._generate_temp_payload()
+        # Bulk readout: samples buffered by the hub for one sensor
+        elif data[1] in pcmd.buffered_temp_desc:
+            ack = pcmd.ack
+            count, interval = 3, 60
+            payload = bytes([data[2], interval, count])
+            for _ in range(count):
+                payload += self._generate_temp_payload()
         # Set sample payload for temperature command
-        if ord(data[1:2]) in range(ord(b'\xD0'), ord(b'\xDF')):
+        elif ord(data[1:2]) in range(ord(b'\xD0'), ord(b'\xDF')):
             ack = pcmd.ack
             #payload = self._generate_temp_payload(temp1=19, temp2=25, humidity=38)
             payload = self._generate_temp_payload()
@@ -330,16 +721,39 @@ class VirtualSerialPort(object):
         # Calculate CRC for command
         crc = self.crc_calc.calculate_crc(payload)
 
-        self._received = pcmd.hdr + ack + self._stuff_bytes_ppp(bytes([data[1]]) + bytes([data[2]]) + payload + crc) + pcmd.end
-        logging.debug('Response (virtual): %s', helpers.print_bytearray(self._received))
+        response = pcmd.hdr + ack + self._stuff_bytes_ppp(bytes([data[1]]) + bytes([data[2]]) + payload + crc) + pcmd.end
+        logging.debug('Response (virtual): %s', helpers.HexDump(response))
+        with self._condition:
+            self._received += response
+            self.in_waiting = len(self._received)
+            self._condition.notify_all()
+
+        if switch_to is not None:
+            self._device_baudrate = switch_to
+            self._trial = True
+        self._last_valid = monotonic()
+
+    def _link_ok(self):
+        """Emulate microcontroller reverting to the safe rate. Returns False if the frame was garbled."""
+        if self._trial and monotonic() - self._last_valid > pcmd.link_revert_timeout:
+            self._device_baudrate = pcmd.baud_rates[0]
+            self._trial = False
+        if self.baudrate != self._device_baudrate:
+            # Rates don't match so microcontroller just sees garbage, and reverts to the safe rate
+            self._device_baudrate = pcmd.baud_rates[0]
+            self._trial = False
+            return False
+        return True
 
     def read(self, size):
-        if self._received:
+        # Block until data is available or timeout expires, like a real port
+        with self._condition:
+            deadline = monotonic() + self.timeout
+            while not self._received and monotonic() < deadline:
+                self._condition.wait(deadline - monotonic())
             read = self._received[:size]
             self._received = self._received[size:]
-        else:
-            read = b''
-        self.in_waiting = len(read)
+            self.in_waiting = len(self._received)
         return read
 
     @staticmethod
@@ -0,0 +1,68 @@
+# Python Standard Library imports
+import logging
+from time import monotonic
+# Ammcon imports
+import ammcon.h_bytecmds as pcmd
+import ammcon.helpers as helpers
+
+# Extra message frame sent by a client to bypass the shadow and always send the command
+FORCE = b'force'
+
+
+class DeviceShadow(object):
+    """Last acknowledged state of each device, used to skip set-state commands that
+    would not change anything (eg. a repeated 'living off').
+
+    State is only recorded from responses that are ACKed and echo back the state that
+    was set, and is trusted for `freshness` seconds (0 disables the shadow).
+    State changed on the device side (eg. an unsolicited event frame) must be cleared with
+    clear(). Changes that the microcontroller never hears about (eg. a physical IR remote)
+    are not seen at all, so freshness is kept short.
+    """
+
+    def __init__(self, freshness=30):
+        self.freshness = freshness
+        # First DESC byte -> (state byte, time acknowledged, response)
+        self.states = {}
+        self.stats = {'suppressed': 0}
+
+    def cached_response(self, command, now=None):
+        """Return cached ACK response if the device is already in the state set by command, else None."""
+        if not self.freshness or command not in pcmd.idempotent_commands:
+            return None
+        now = monotonic() if now is None else now
+        state = self.states.get(command[0])
+        if state is None:
+            return None
+        value, acked_at, response = state
+        if value != command[1] or now - acked_at > self.freshness:
+            return None
+        self.stats['suppressed'] += 1
+        logging.debug('Device %s already in state %s - not sending.', hex(command[0]), hex(value))
+        return response
+
+    def update(self, command, frame, now=None):
+        """Record state set by command from the (CRC checked) response frame."""
+        if not command:
+            return
+        device = command[0]
+        # Any command to a device or one linked to it may have changed its state
+        self.invalidate(device)
+
+        if command not in pcmd.idempotent_commands:
+            return
+        # Set-state responses echo the state byte back inverted
+        if (frame.is_ack and frame.desc[0] == device and len(frame.payload)
+                and helpers.light_state(frame.payload) == command[1]):
+            now = monotonic() if now is None else now
+            self.states[device] = (command[1], now, bytes(frame.raw))
+
+    def invalidate(self, device):
+        """Forget state of a device (first DESC byte) and any devices linked to it."""
+        self.states.pop(device, None)
+        for linked in pcmd.linked_devices.get(device, ()):
+            self.states.pop(linked, None)
+
+    def clear(self):
+        """Forget state of all devices."""
+        self.states.clear()
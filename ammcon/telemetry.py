@@ -0,0 +1,86 @@
+"""Fan-out of sensor readings over zeroMQ PUB/SUB.
+
+The serial worker publishes every decoded sensor reading once, so consumers
+(DB logger, dashboards, alerting etc.) can subscribe instead of each sending
+their own requests down the serial link.
+"""
+
+# Imports from Python Standard Library
+import json
+from time import time
+# Third party imports
+import zmq
+# Ammcon imports
+import ammcon.h_bytecmds as pcmd
+
+TOPIC_PREFIX = b'temp.'
+EVENT_PREFIX = b'event.'
+
+
+def device_topic(desc):
+    """Return telemetry topic for the sensor with the given response DESC bytes."""
+    name, _ = pcmd.sensor_devices.get(bytes(desc), (bytes(desc).hex(), None))
+    return TOPIC_PREFIX + name.encode()
+
+
+class TelemetryPublisher(object):
+    """PUB socket used by the serial worker to publish sensor readings."""
+
+    def __init__(self, port):
+        context = zmq.Context().instance()
+        self.socket = context.socket(zmq.PUB)
+        self.socket.bind("tcp://127.0.0.1:{}".format(port))
+
+    def publish_reading(self, desc, temperature, humidity, timestamp=None):
+        """Publish a temperature/humidity reading on the topic of the sensor it came from.
+        timestamp: when reading was taken (epoch seconds), defaults to now.
+        """
+        _, device_id = pcmd.sensor_devices.get(bytes(desc), (None, None))
+        reading = {'desc': bytes(desc).hex(),
+                   'device_id': device_id,
+                   'temperature': temperature,
+                   'humidity': humidity,
+                   'timestamp': time() if timestamp is None else timestamp}
+        self.socket.send_multipart([device_topic(desc), json.dumps(reading).encode()])
+
+    def publish_event(self, desc, payload):
+        """Publish an unsolicited frame from the microcontroller (eg. device-initiated status)."""
+        event = {'desc': bytes(desc).hex(),
+                 'payload': bytes(payload).hex(),
+                 'timestamp': time()}
+        self.socket.send_multipart([EVENT_PREFIX + bytes(desc).hex().encode(), json.dumps(event).encode()])
+
+    def close(self):
+        self.socket.close()
+
+
+class TelemetrySubscriber(object):
+    """SUB socket for consumers of sensor readings.
+
+    topics: list of topic names to subscribe to (eg. ['living']), defaults to all sensors.
+    events: also subscribe to unsolicited frames from the microcontroller.
+    """
+
+    def __init__(self, port, topics=None, events=False):
+        context = zmq.Context().instance()
+        self.socket = context.socket(zmq.SUB)
+        self.socket.connect("tcp://127.0.0.1:{}".format(port))
+        if topics:
+            for topic in topics:
+                self.socket.setsockopt(zmq.SUBSCRIBE, TOPIC_PREFIX + topic.encode())
+        else:
+            self.socket.setsockopt(zmq.SUBSCRIBE, TOPIC_PREFIX)
+        if events:
+            self.socket.setsockopt(zmq.SUBSCRIBE, EVENT_PREFIX)
+
+    def poll(self, timeout):
+        """Return True if a reading is waiting to be received (timeout in milliseconds)."""
+        return bool(self.socket.poll(timeout, zmq.POLLIN))
+
+    def recv(self):
+        """Block until next reading is received, return (topic, reading dict)."""
+        topic, message = self.socket.recv_multipart()
+        return topic, json.loads(message.decode())
+
+    def close(self):
+        self.socket.close()
@@ -1,25 +1,50 @@
 # Imports from Python Standard Library
+import datetime as dt
 import logging
 from threading import Thread
-from time import sleep
+from time import monotonic
 # Third party imports
 import zmq
 # Ammcon imports
 import ammcon.h_bytecmds as pcmd
 import ammcon.helpers as helpers
 from ammcon import Session
+from ammcon.broker import BUSY, EXPIRED, RATE_LIMITED, TIMEOUT
 from ammcon.models import Temperature
+from ammcon.telemetry import TelemetrySubscriber
 
 
 class TempLogger(Thread):
-    """Get current temperature and log to database."""
+    """Periodically request current temperature, and log all published sensor readings to database.
 
-    def __init__(self, interval=60):
+    Readings are received from the serial worker's telemetry stream rather than from the
+    reply to our own request, so readings requested by other clients are logged as well.
+
+    Adaptive mode: the polling interval is halved (down to min_interval) after an interval
+    in which a reading changed, and grown by half (up to max_interval) while readings are stable.
+    Readings are only stored if they leave the deadband around the last stored value of that
+    device, or if heartbeat seconds have passed since it was last stored. The stored data is
+    therefore a step-wise series, see models.temperature_series().
+    """
+
+    def __init__(self, interval=60, telemetry_port=7777, adaptive=False, min_interval=10, max_interval=600,
+                 temp_deadband=0.0, humidity_deadband=0.0, heartbeat=3600, command='temp'):
         Thread.__init__(self)
         # Disable daemon so that thread isn't killed during a file write
         self.daemon = False
         # Set logging interval (in seconds)
         self.interval = interval
+        # Command used to poll sensors ('temp all' reads all sensors in one round trip)
+        self.command = pcmd.micro_commands[command]
+        self.adaptive = adaptive
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # Storage deadband (degC, %RH) and max time between stored readings (seconds)
+        self.temp_deadband = temp_deadband
+        self.humidity_deadband = humidity_deadband
+        self.heartbeat = heartbeat
+        # Device id -> (temperature, humidity, timestamp) of last stored reading
+        self.last_stored = {}
         # Flag used to gracefully exit thread
         self.stop_thread = 0
 
@@ -28,71 +53,105 @@ class TempLogger(Thread):
         # fails then we're screwed anyway)
         context = zmq.Context().instance()
         self.socket = context.socket(zmq.REQ)
+        # Don't wait forever for a reply; relaxed/correlated REQ allows sending again after a timeout
+        self.socket.setsockopt(zmq.RCVTIMEO, 30000)
+        self.socket.setsockopt(zmq.REQ_RELAXED, 1)
+        self.socket.setsockopt(zmq.REQ_CORRELATE, 1)
         self.socket.connect('tcp://127.0.0.1:5555')
         logging.info('############### Connected to zeroMQ server ###############')
 
+        # Subscribe to sensor readings published by the serial worker
+        self.subscriber = TelemetrySubscriber(telemetry_port)
+
     def run(self):
         logging.info('############### Started templogger ###############')
         while self.stop_thread != 1:
-            # TO DO: support for multiple devices
-            command = pcmd.micro_commands.get('temp', None)
-
-            try:
-                # TO DO: use ZMQ message tracker?
-                message_tracker = self.socket.send(command, copy=False, track=True)
-            except zmq.ZMQError:
-                logging.error("ZMQ send failed.")
-
-            # Added (temporarily) for debugging purposes
-            n = 0
-            while not message_tracker.done:
-                logging.debug("yarp{}{}".format('temp', n))
-                n += 1
-
-            logging.debug('Requesting temperature.')
-            response = self.socket.recv()  # blocks until response is found
-            logging.debug('Received    : %s', helpers.print_bytearray(response))
-
-            # TO DO: fix kludges
-            if not response == 'invalid CRC'.encode():
-                try:
-                    temp, humidity = helpers.temp_val(response)
-                except Exception as e:
-                    # TO DO: fix this kludge
-                    # templogger gets non-temp response back from microcontroller
-                    # ZMQ is on a strict recv/send pattern so it's highly unlikely to be ZMQ messing up destinations
-                    # possibly to do with microcontroller or the serial buffer?
-                    logging.debug('fack %s' % e)
-                    temp = None
-                    humidity = None
-
-                if temp is not None:
-                    data_log = Temperature(
-                        device_id=1,
-                        temperature=temp,
-                        humidity=humidity
-                    )
-
-                    session = Session()
-                    session.add(data_log)
-                    try:
-                        session.commit()
-                    except Exception as err:
-                        session.rollback()
-                        logging.error('Failed to write to DB, %s.' % err)
-                    finally:
-                        session.close()
-            else:
-                logging.info("Invalid CRC - not logging.")
-
-            # Break logging interval into 1sec sleeps so don't have to wait too long when quitting thread.
-            for _ in range(self.interval):
-                if self.stop_thread:
-                    logging.debug('Templogger thread stop trigger received, breaking out of sleep loop.')
-                    break
-                sleep(1)
+            self.request_temp()
+
+            # Wait out logging interval in 1sec polls, storing readings as they are published.
+            # Also means don't have to wait too long when quitting thread.
+            changed = False
+            deadline = monotonic() + self.interval
+            while not self.stop_thread and monotonic() < deadline:
+                if self.subscriber.poll(1000):
+                    _, reading = self.subscriber.recv()
+                    changed |= self.handle_reading(reading)
+            if self.stop_thread:
+                logging.debug('Templogger thread stop trigger received, breaking out of sleep loop.')
+
+            if self.adaptive:
+                self.adapt_interval(changed)
 
         logging.debug('Templogger thread stop trigger received, stopping while loop.')
 
+    def request_temp(self):
+        """Ask serial worker for the current temperature. The readings themselves arrive via telemetry."""
+        logging.debug('Requesting temperature.')
+        try:
+            self.socket.send(self.command)
+            response = self.socket.recv()
+        except zmq.Again:
+            logging.warning('Timed out waiting for temperature response.')
+            return
+        except zmq.ZMQError:
+            logging.error("ZMQ send failed.")
+            return
+        logging.debug('Received    : %s', helpers.HexDump(response))
+
+        # TO DO: fix kludges
+        if response in (BUSY, RATE_LIMITED, EXPIRED, TIMEOUT):
+            logging.info('Request not serviced by broker (%s).', response.decode())
+        elif response == 'invalid CRC'.encode():
+            logging.info("Invalid CRC - not logging.")
+
+    def adapt_interval(self, changed):
+        """Poll more often while readings are changing, back off while they are stable."""
+        if changed:
+            self.interval = max(self.min_interval, self.interval // 2)
+        else:
+            self.interval = min(self.max_interval, self.interval + max(1, self.interval // 2))
+        logging.debug('Temperature polling interval now %ss.', self.interval)
+
+    def handle_reading(self, reading):
+        """Store reading (in adaptive mode, only if it left the deadband or heartbeat is due).
+        Returns True if it left the deadband.
+        """
+        device_id = reading['device_id']
+        if device_id is None:
+            # Sensor DESC not listed in pcmd.sensor_devices, log against the default device
+            logging.debug('Reading from unknown sensor %s.', reading['desc'])
+            device_id = 1
+
+        last = self.last_stored.get(device_id)
+        changed = (last is None
+                   or abs(reading['temperature'] - last[0]) > self.temp_deadband
+                   or abs(reading['humidity'] - last[1]) > self.humidity_deadband)
+        if not self.adaptive or changed or reading['timestamp'] - last[2] >= self.heartbeat:
+            if self.store_reading(device_id, reading):
+                self.last_stored[device_id] = (reading['temperature'], reading['humidity'], reading['timestamp'])
+        return changed
+
+    @staticmethod
+    def store_reading(device_id, reading):
+        """Write a published sensor reading to the database. Returns True if successful."""
+        data_log = Temperature(
+            device_id=device_id,
+            temperature=reading['temperature'],
+            humidity=reading['humidity'],
+            datetime=dt.datetime.utcfromtimestamp(reading['timestamp'])
+        )
+
+        session = Session()
+        session.add(data_log)
+        try:
+            session.commit()
+        except Exception as err:
+            session.rollback()
+            logging.error('Failed to write to DB, %s.' % err)
+            return False
+        finally:
+            session.close()
+        return True
+
     def stop(self):
         self.stop_thread = 1
@@ -0,0 +1,19 @@
+# Python Standard Library imports
+import os
+import socket
+import tempfile
+
+import pytest
+
+# ammcon creates its sqlite database under AMMCON_LOCAL on import, so keep it out of the user's home dir
+os.environ['AMMCON_LOCAL'] = tempfile.mkdtemp(prefix='ammcon_test_')
+
+
+@pytest.fixture
+def free_port():
+    """Return a function returning an unused localhost TCP port."""
+    def get_port():
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            return s.getsockname()[1]
+    return get_port
@@ -0,0 +1,40 @@
+# Python Standard Library imports
+import glob
+import os
+import subprocess
+import sys
+
+# Logs a burst of records then dies with an exception, as when no serial device is connected
+CRASH_AFTER_LOGGING = """
+import logging
+from ammcon.background_worker import setup_logging
+setup_logging()
+for i in range(2001):
+    logging.debug('record %s', i)
+logging.error('No serial device detected.')
+raise AttributeError('serial port is None')
+"""
+
+
+def test_log_records_written_when_main_raises(tmp_path):
+    env = dict(os.environ, AMMCON_LOCAL=str(tmp_path))
+    result = subprocess.run([sys.executable, '-c', CRASH_AFTER_LOGGING], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+    assert b'AttributeError' in result.stderr
+
+    log_files = glob.glob(os.path.join(str(tmp_path), 'logs', 'ammcon_serial_*.log'))
+    assert len(log_files) == 1
+    with open(log_files[0]) as f:
+        lines = f.read().splitlines()
+    assert 'record 2000' in lines[-2]
+    assert 'No serial device detected.' in lines[-1]
+
+
+def test_pstats_rejected_on_python_312(monkeypatch):
+    from click.testing import CliRunner
+    from ammcon.background_worker import main
+
+    monkeypatch.setattr(sys, 'version_info', (3, 12, 0, 'final', 0))
+    result = CliRunner().invoke(main, ['--profile', '--profile-format', 'pstats'])
+    assert result.exit_code == 2
+    assert 'pstats needs Python < 3.12' in result.output
@@ -0,0 +1,149 @@
+# Python Standard Library imports
+import json
+import time
+# Third party imports
+import pytest
+import zmq
+# Ammcon imports
+from ammcon.broker import BUSY, STATS_COMMAND, TIMEOUT, Broker
+
+
+def req_socket(port):
+    """REQ socket set up the same way as TempLogger's."""
+    socket = zmq.Context().instance().socket(zmq.REQ)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.setsockopt(zmq.RCVTIMEO, 2000)
+    socket.setsockopt(zmq.REQ_RELAXED, 1)
+    socket.setsockopt(zmq.REQ_CORRELATE, 1)
+    socket.connect('tcp://127.0.0.1:{}'.format(port))
+    return socket
+
+
+@pytest.fixture
+def broker(free_port):
+    """Return function starting a broker with the given options, plus a REP socket standing in for the serial worker."""
+    started = []
+
+    def start(**kwargs):
+        frontend_port, backend_port = free_port(), free_port()
+        device = Broker(frontend_port, backend_port, **kwargs)
+        device.start()
+        worker = zmq.Context().instance().socket(zmq.REP)
+        worker.setsockopt(zmq.LINGER, 0)
+        worker.setsockopt(zmq.RCVTIMEO, 2000)
+        worker.connect('tcp://127.0.0.1:{}'.format(backend_port))
+        started.append((device, worker))
+        return device, worker, frontend_port
+
+    yield start
+    for device, worker in started:
+        device.stop()
+        device.join()
+        worker.close()
+
+
+def test_split_envelope():
+    assert Broker.split_envelope([b'id', b'', b'temp']) == ([b'id', b''], [b'temp'])
+    # Correlated REQ adds a request id before the delimiter
+    assert Broker.split_envelope([b'id', b'\x00\x01', b'', b'temp', b'force']) == \
+        ([b'id', b'\x00\x01', b''], [b'temp', b'force'])
+    assert Broker.split_envelope([b'id', b'temp']) == (None, None)
+
+
+def test_correlated_request_reply(broker):
+    _, worker, port = broker()
+    client = req_socket(port)
+    client.send_multipart([b'\xD1', b'force'])
+    assert worker.recv_multipart() == [b'\xD1', b'force']
+    worker.send(b'response')
+    assert client.recv() == b'response'
+    client.close()
+
+
+def test_in_flight_timeout(broker):
+    device, worker, port = broker(request_timeout=0.2)
+    client = req_socket(port)
+    client.send(b'first')
+    assert worker.recv() == b'first'
+    assert client.recv() == TIMEOUT
+    assert device.stats['timed_out'] == 1
+
+    # Late reply is dropped rather than answering the next request
+    worker.send(b'late')
+    client.send(b'second')
+    assert worker.recv() == b'second'
+    worker.send(b'on time')
+    assert client.recv() == b'on time'
+    client.close()
+
+
+def test_queue_full(broker):
+    device, worker, port = broker(queue_depth=1, request_timeout=5)
+    clients = [req_socket(port) for _ in range(3)]
+    for i, client in enumerate(clients):
+        client.send(b'request %d' % i)
+        time.sleep(0.2)
+    # First is in flight, second is queued, third is rejected
+    assert clients[2].recv() == BUSY
+    assert device.stats['rejected_busy'] == 1
+
+    assert worker.recv() == b'request 0'
+    worker.send(b'reply 0')
+    assert clients[0].recv() == b'reply 0'
+    assert worker.recv() == b'request 1'
+    worker.send(b'reply 1')
+    assert clients[1].recv() == b'reply 1'
+    for client in clients:
+        client.close()
+
+
+def test_stats(broker):
+    _, worker, port = broker()
+    client = req_socket(port)
+    client.send(b'temp')
+    worker.recv()
+    worker.send(b'ok')
+    client.recv()
+    client.send(STATS_COMMAND)
+    stats = json.loads(client.recv().decode())
+    assert stats['forwarded'] == 1
+    assert stats['in_flight'] is False
+    client.close()
+
+
+def test_templogger_through_broker_to_virtual_serial(free_port):
+    """End to end: TempLogger's REQ socket -> broker -> VirtualSerialManager, reading published as telemetry."""
+    # Ports the serial worker and TempLogger connect to are fixed
+    from ammcon.serialmanager import VirtualSerialManager
+    from ammcon.templogger import TempLogger
+
+    telemetry_port = free_port()
+    device = Broker(5555, 6666, request_timeout=3)
+    device.start()
+    serial_port = VirtualSerialManager('virtual', telemetry_port=telemetry_port, shadow_freshness=0)
+    serial_port.start()
+    temp_logger = TempLogger(telemetry_port=telemetry_port)
+    try:
+        # Slow joiner: give the subscription time to reach the publisher
+        time.sleep(0.5)
+        temp_logger.socket.send(b'\xD1\x00')
+        response = temp_logger.socket.recv()
+        assert response[:1] == b'\x3C' and response[2:4] == b'\xD1\x00'
+
+        assert temp_logger.subscriber.poll(2000)
+        topic, reading = temp_logger.subscriber.recv()
+        assert topic == b'temp.living'
+        assert reading['device_id'] == 1
+        assert temp_logger.handle_reading(reading)
+    finally:
+        temp_logger.socket.close()
+        temp_logger.subscriber.close()
+        serial_port.stop()
+        serial_port.join()
+        serial_port.close()
+        serial_port.socket.close()
+        device.stop()
+        device.join()
+        # Free the fixed ports for other tests
+        device.frontend.close()
+        device.backend.close()
@@ -0,0 +1,56 @@
+# Ammcon imports
+import ammcon.frame
+import ammcon.h_bytecmds as pcmd
+from ammcon.frame import Frame, decoder_for, register_decoder
+from ammcon.helpers import bulk_temp_payload, light_state, temp_payload
+from ammcon.serialmanager import CRC
+
+crc_calc = CRC(width=8, poly=pcmd.poly, initvalue=pcmd.init)
+
+
+def make_frame(desc, payload, ack=pcmd.ack):
+    return Frame(bytearray(pcmd.hdr + ack + desc + payload + crc_calc.calculate_crc(payload) + pcmd.end))
+
+
+def test_fields():
+    frame = make_frame(b'\xD1\x00', b'\x15\x32\x28\x00')
+    assert frame.is_valid
+    assert frame.is_ack
+    assert bytes(frame.desc) == b'\xD1\x00'
+    assert bytes(frame.payload) == b'\x15\x32\x28\x00'
+    assert crc_calc.check_crc(frame.crc_region)
+    # Fields are views over the receive buffer, not copies
+    assert isinstance(frame.payload, memoryview) and frame.payload.obj is frame.raw
+
+
+def test_nak_and_short_frames():
+    assert not make_frame(b'\xB1\x00', b'\xFF', ack=pcmd.nak).is_ack
+    assert not Frame(bytearray(b'\x3C\x06\xD1\x3E')).is_valid
+
+
+def test_corrupt_crc():
+    frame = make_frame(b'\xD1\x00', b'\x15\x32\x28\x00')
+    frame.raw[4] ^= 0x01
+    assert not crc_calc.check_crc(frame.crc_region)
+
+
+def test_decode():
+    assert make_frame(b'\xD1\x00', b'\x15\x32\x28\x00').decode() == (21.5, 40.0)
+    assert make_frame(b'\xB1\x00', b'\xFE').decode() == 0x01
+    assert make_frame(b'\xDA\x00', b'\x01\x00\x15\x32\x28\x00').decode() == [(0, 21.5, 40.0)]
+    assert make_frame(b'\x99\x00', b'\x00').decode() is None
+
+
+def test_narrowest_decoder_wins():
+    assert decoder_for(0xD1) is temp_payload
+    assert decoder_for(0xDA) is bulk_temp_payload
+    assert decoder_for(0xB2) is light_state
+
+    @register_decoder(range(0xD5, 0xD6))
+    def special(payload):
+        return 'special'
+    try:
+        assert decoder_for(0xD5) is special
+        assert decoder_for(0xD4) is temp_payload
+    finally:
+        ammcon.frame._decoders.remove((range(0xD5, 0xD6), special))
@@ -0,0 +1,26 @@
+# Python Standard Library imports
+import pytest
+# Ammcon imports
+from ammcon.helpers import buffered_temp_payload, bulk_temp_payload, temp_payload, temp_val
+
+
+def test_temp_payload():
+    assert temp_payload(b'\x15\x32\x28\x19') == (21.5, pytest.approx(40.25))
+
+
+def test_temp_val_skips_frame_header():
+    assert temp_val(b'\x3C\x06\xD1\x00\x15\x32\x28\x19\x00\x3E') == (21.5, pytest.approx(40.25))
+
+
+def test_bulk_temp_payload():
+    payload = b'\x02' + b'\x00\x15\x32\x28\x00' + b'\x01\x12\x00\x3C\x32'
+    assert bulk_temp_payload(payload) == [(0, 21.5, 40.0), (1, 18.0, 60.5)]
+    assert bulk_temp_payload(memoryview(payload)) == [(0, 21.5, 40.0), (1, 18.0, 60.5)]
+    assert bulk_temp_payload(b'\x00') == []
+
+
+def test_buffered_temp_payload():
+    payload = b'\x01\x3C\x02' + b'\x15\x32\x28\x19' + b'\x16\x00\x29\x32'
+    sensor, interval, samples = buffered_temp_payload(memoryview(payload))
+    assert (sensor, interval) == (1, 60)
+    assert samples == [(21.5, pytest.approx(40.25)), (22.0, 41.5)]
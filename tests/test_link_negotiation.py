@@ -0,0 +1,54 @@
+# Third party imports
+import pytest
+# Ammcon imports
+from ammcon.serialmanager import VirtualSerialManager
+
+BAUDRATES = (921600, 460800, 230400)
+
+
+@pytest.fixture
+def negotiate(free_port):
+    """Return function negotiating the serial link with an emulated microcontroller, returning the manager."""
+    managers = []
+
+    def start(**port_options):
+        manager = VirtualSerialManager('virtual', port_options=port_options, telemetry_port=free_port(),
+                                       baudrate=115200, baudrates=BAUDRATES)
+        managers.append(manager)
+        return manager
+
+    yield start
+    # Reader thread was never started, so close sockets directly
+    for manager in managers:
+        manager.socket.close()
+        manager.telemetry.close()
+        manager.wol.close()
+
+
+def test_highest_rate(negotiate):
+    manager = negotiate()
+    assert manager.ser.baudrate == 921600
+    assert manager.link_stats['baudrate'] == 921600
+    assert manager.link_stats['bytes_per_second'] > 0
+
+
+def test_fallback_on_corrupted_echoes(negotiate):
+    manager = negotiate(error_baudrate=460800)
+    assert manager.ser.baudrate == 230400
+    assert manager.link_stats['baudrate'] == 230400
+    # Microcontroller followed back down to each rate in turn
+    assert manager.ser._device_baudrate == 230400
+
+
+def test_lost_confirmation_retried(negotiate):
+    manager = negotiate(lost_confirmations=1)
+    assert manager.ser.baudrate == 921600
+    assert manager.ser._device_baudrate == 921600
+    assert manager.ser.lost_confirmations == 0
+
+
+def test_all_rates_refused(negotiate):
+    manager = negotiate(max_baudrate=115200)
+    assert manager.ser.baudrate == 115200
+    assert manager.link_stats['baudrate'] == 115200
+    assert manager.link_stats['bytes_per_second'] > 0
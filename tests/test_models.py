@@ -0,0 +1,59 @@
+# Python Standard Library imports
+import datetime as dt
+# Third party imports
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+# Ammcon imports
+from ammcon.models import Base, Temperature, temperature_series
+
+T0 = dt.datetime(2017, 1, 1, 12, 0)
+
+
+def minutes(n):
+    return T0 + dt.timedelta(minutes=n)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    # Stored (deadband filtered) readings: before the window, inside it, and another device
+    session.add_all([Temperature(device_id=1, temperature=20.0, humidity=40.0, datetime=minutes(-5)),
+                     Temperature(device_id=1, temperature=21.0, humidity=41.0, datetime=minutes(10)),
+                     Temperature(device_id=1, temperature=22.0, humidity=42.0, datetime=minutes(20)),
+                     Temperature(device_id=2, temperature=30.0, humidity=50.0, datetime=minutes(15))])
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_series_at_stored_readings(session):
+    assert temperature_series(session, 1, minutes(0), minutes(30)) == [
+        (minutes(0), 20.0, 40.0),
+        (minutes(10), 21.0, 41.0),
+        (minutes(20), 22.0, 42.0),
+        (minutes(30), 22.0, 42.0),
+    ]
+
+
+def test_series_resampled(session):
+    series = temperature_series(session, 1, minutes(0), minutes(20), step=dt.timedelta(minutes=5))
+    assert [(temp, hum) for _, temp, hum in series] == [(20.0, 40.0), (20.0, 40.0), (21.0, 41.0),
+                                                         (21.0, 41.0), (22.0, 42.0)]
+
+
+def test_series_gaps(session):
+    series = temperature_series(session, 1, minutes(0), minutes(30), max_gap=dt.timedelta(minutes=8))
+    assert series == [
+        (minutes(0), 20.0, 40.0),
+        (minutes(10), 21.0, 41.0),
+        (minutes(20), 22.0, 42.0),
+        (minutes(30), None, None),
+    ]
+
+
+def test_series_without_earlier_reading(session):
+    series = temperature_series(session, 2, minutes(0), minutes(20))
+    assert series == [(minutes(0), None, None), (minutes(15), 30.0, 50.0), (minutes(20), 30.0, 50.0)]
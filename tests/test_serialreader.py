@@ -0,0 +1,76 @@
+# Ammcon imports
+import ammcon.h_bytecmds as pcmd
+from ammcon.serialmanager import CRC, SerialReader, VirtualSerialPort
+
+crc_calc = CRC(width=8, poly=pcmd.poly, initvalue=pcmd.init)
+
+
+def wire_frame(desc, payload):
+    """Frame as sent by the microcontroller: byte-stuffed, with CRC over the payload."""
+    body = desc + payload + crc_calc.calculate_crc(payload)
+    return pcmd.hdr + pcmd.ack + VirtualSerialPort._stuff_bytes_ppp(body) + pcmd.end
+
+
+def receive(reader, data):
+    for frame in reader.feed(data):
+        reader.route(frame)
+
+
+def test_full_desc_match():
+    reader = SerialReader(None)
+    bedroom2 = reader.expect(pcmd.micro_commands['tempbedroom2'])
+    bedroom3 = reader.expect(pcmd.micro_commands['tempbedroom3'])
+    receive(reader, wire_frame(b'\xD1\x02', b'\x15\x32\x28\x00'))
+    assert bytes(bedroom3.get_nowait().desc) == b'\xD1\x02'
+    assert bedroom2.empty()
+    assert reader.pending == {b'\xD1\x01': bedroom2}
+
+
+def test_one_byte_command_matches_first_desc_byte():
+    reader = SerialReader(None)
+    response_queue = reader.expect(pcmd.micro_commands['temp'])
+    receive(reader, wire_frame(b'\xD1\x00', b'\x15\x32\x28\x00'))
+    frame = response_queue.get_nowait()
+    assert crc_calc.check_crc(frame.crc_region)
+    assert frame.decode() == (21.5, 40.0)
+
+
+def test_late_response_is_stale():
+    reader = SerialReader(None)
+    response_queue = reader.expect(pcmd.micro_commands['tempbedroom2'])
+    # Late response to an earlier (timed out) request for another sensor
+    receive(reader, wire_frame(b'\xD1\x00', b'\x15\x32\x28\x00'))
+    assert response_queue.empty()
+    assert reader.stats['stale'] == 1
+
+
+def test_events():
+    reader = SerialReader(None)
+    receive(reader, wire_frame(b'\xE1\x00', b'\x01'))
+    assert bytes(reader.events.get_nowait().payload) == b'\x01'
+    assert reader.stats == {'frames': 1, 'events': 1, 'stale': 0}
+
+
+def test_frame_split_across_reads():
+    reader = SerialReader(None)
+    response_queue = reader.expect(pcmd.micro_commands['tempbedroom2'])
+    # Payload contains bytes that need escaping
+    data = wire_frame(b'\xD1\x01', b'\x3C\x3E\x7C\x00')
+    assert len(data) > 12
+    for i in range(0, len(data), 5):
+        receive(reader, data[i:i + 5])
+    frame = response_queue.get_nowait()
+    assert bytes(frame.payload) == b'\x3C\x3E\x7C\x00'
+    assert crc_calc.check_crc(frame.crc_region)
+
+
+def test_response_routed_after_timeout_is_stale():
+    reader = SerialReader(None)
+    command = pcmd.micro_commands['tempbedroom2']
+    response_queue = reader.expect(command)
+    # Requester timed out, but response is routed before it cancels
+    receive(reader, wire_frame(b'\xD1\x01', b'\x15\x32\x28\x00'))
+    reader.cancel(command, response_queue)
+    assert response_queue.empty()
+    assert reader.stats['stale'] == 1
+    assert not reader.pending
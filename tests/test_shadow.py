@@ -0,0 +1,86 @@
+# Python Standard Library imports
+from time import monotonic
+from types import SimpleNamespace
+from unittest.mock import Mock
+# Ammcon imports
+import ammcon.h_bytecmds as pcmd
+from ammcon.frame import Frame
+from ammcon.serialmanager import CRC, SerialManager, SerialReader
+from ammcon.shadow import DeviceShadow
+
+BEDROOM_ON = pcmd.micro_commands['bedroom on']
+BEDROOM_OFF = pcmd.micro_commands['bedroom off']
+
+
+def response(command, ack=pcmd.ack):
+    """Light response frame: DESC echoed back, payload is the state byte inverted (CRC not checked here)."""
+    return Frame(bytearray(pcmd.hdr + ack + command + bytes([~command[1] & 0xFF]) + b'\x00' + pcmd.end))
+
+
+def test_repeated_command_suppressed():
+    shadow = DeviceShadow(freshness=300)
+    assert shadow.cached_response(BEDROOM_ON, now=0) is None
+    frame = response(BEDROOM_ON)
+    shadow.update(BEDROOM_ON, frame, now=0)
+    assert shadow.cached_response(BEDROOM_ON, now=10) == bytes(frame.raw)
+    assert shadow.stats['suppressed'] == 1
+    # Different state is always sent
+    assert shadow.cached_response(BEDROOM_OFF, now=10) is None
+
+
+def test_state_goes_stale():
+    shadow = DeviceShadow(freshness=300)
+    shadow.update(BEDROOM_ON, response(BEDROOM_ON), now=0)
+    assert shadow.cached_response(BEDROOM_ON, now=301) is None
+
+
+def test_disabled():
+    shadow = DeviceShadow(freshness=0)
+    shadow.update(BEDROOM_ON, response(BEDROOM_ON), now=0)
+    assert shadow.cached_response(BEDROOM_ON, now=0) is None
+
+
+def test_nak_or_wrong_echo_not_recorded():
+    shadow = DeviceShadow()
+    shadow.update(BEDROOM_ON, response(BEDROOM_ON, ack=pcmd.nak), now=0)
+    assert shadow.cached_response(BEDROOM_ON, now=0) is None
+    shadow.update(BEDROOM_ON, response(BEDROOM_OFF), now=0)
+    assert shadow.cached_response(BEDROOM_ON, now=0) is None
+
+
+def test_non_idempotent_commands_never_cached():
+    shadow = DeviceShadow()
+    command = pcmd.micro_commands['temp']
+    assert command not in pcmd.idempotent_commands
+    assert shadow.cached_response(command, now=0) is None
+
+
+def test_linked_devices_invalidated():
+    shadow = DeviceShadow()
+    living1_on = pcmd.micro_commands['living1 on']
+    living_off = pcmd.micro_commands['living off']
+    shadow.update(living1_on, response(living1_on), now=0)
+    # 'living' switches both living1 and living2
+    shadow.update(living_off, response(living_off), now=1)
+    assert shadow.cached_response(living1_on, now=2) is None
+    assert shadow.cached_response(living_off, now=2) is not None
+
+
+def test_clear():
+    shadow = DeviceShadow()
+    shadow.update(BEDROOM_ON, response(BEDROOM_ON), now=0)
+    shadow.clear()
+    assert shadow.cached_response(BEDROOM_ON, now=1) is None
+
+
+def test_event_clears_shadow():
+    reader = SerialReader(None)
+    worker = SimpleNamespace(reader=reader, shadow=DeviceShadow(), telemetry=Mock(),
+                             crc_calc=CRC(width=8, poly=pcmd.poly, initvalue=pcmd.init))
+    worker.shadow.update(BEDROOM_ON, response(BEDROOM_ON), now=monotonic())
+    payload = b'\x01'
+    reader.events.put(Frame(bytearray(pcmd.hdr + pcmd.ack + b'\xE0\x00' + payload
+                                      + worker.crc_calc.calculate_crc(payload) + pcmd.end)))
+    SerialManager.publish_events(worker)
+    worker.telemetry.publish_event.assert_called_once()
+    assert worker.shadow.cached_response(BEDROOM_ON) is None
@@ -0,0 +1,73 @@
+# Python Standard Library imports
+import json
+from socket import socket, AF_INET, SOCK_DGRAM
+# Third party imports
+import pytest
+import zmq
+# Ammcon imports
+from ammcon.helpers import MagicPacketSender
+from ammcon.serialmanager import VirtualSerialManager
+
+MAC = '01:23:45:67:89:ab'
+MAC_BYTES = b'\x01\x23\x45\x67\x89\xab'
+
+
+@pytest.fixture
+def receiver():
+    """Local UDP socket standing in for the broadcast address."""
+    sock = socket(family=AF_INET, type=SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(2)
+    yield sock
+    sock.close()
+
+
+def receive_packets(sock, count):
+    return [sock.recv(1024) for _ in range(count)]
+
+
+def test_packet_layout_and_cache():
+    with MagicPacketSender('127.0.0.1') as sender:
+        packet = sender.magic_packet(MAC)
+        assert len(packet) == 102
+        assert packet == b'\xFF' * 6 + MAC_BYTES * 16
+        assert sender.magic_packet(MAC) is packet
+
+
+def test_separators():
+    with MagicPacketSender('127.0.0.1') as sender:
+        assert sender.magic_packet('01-23-45-67-89-AB') == sender.magic_packet(MAC)
+        assert sender.magic_packet('0123456789ab') == sender.magic_packet(MAC)
+
+
+def test_malformed_mac_nak_others_sent(receiver):
+    with MagicPacketSender('127.0.0.1', receiver.getsockname()[1]) as sender:
+        status = sender.send([MAC, '01:23:45', 'not a mac', '02-00-00-00-00-01'], repeat=2)
+    assert status == {MAC: 'ACK', '01:23:45': 'NAK', 'not a mac': 'NAK', '02-00-00-00-00-01': 'ACK'}
+    packets = receive_packets(receiver, 4)
+    assert sorted(packets) == sorted([b'\xFF' * 6 + MAC_BYTES * 16,
+                                      b'\xFF' * 6 + b'\x02\x00\x00\x00\x00\x01' * 16] * 2)
+
+
+def test_wol_command(receiver, free_port):
+    """'wol' command is answered by the serial worker itself with the JSON status of each host."""
+    # Stand in for the broker: serial worker's REP socket connects to the fixed backend port
+    backend = zmq.Context().instance().socket(zmq.DEALER)
+    backend.setsockopt(zmq.LINGER, 0)
+    backend.setsockopt(zmq.RCVTIMEO, 5000)
+    backend.bind('tcp://127.0.0.1:6666')
+    serial_port = VirtualSerialManager('virtual', telemetry_port=free_port(), wol_repeat=1)
+    serial_port.wol.close()
+    serial_port.wol = MagicPacketSender('127.0.0.1', receiver.getsockname()[1])
+    serial_port.start()
+    try:
+        backend.send_multipart([b'', b'wol', MAC.encode(), b'bad'])
+        delimiter, reply = backend.recv_multipart()
+        assert json.loads(reply.decode()) == {MAC: 'ACK', 'bad': 'NAK'}
+        assert receive_packets(receiver, 1) == [b'\xFF' * 6 + MAC_BYTES * 16]
+    finally:
+        serial_port.stop()
+        serial_port.join()
+        serial_port.close()
+        serial_port.socket.close()
+        backend.close()